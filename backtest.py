@@ -0,0 +1,382 @@
+import argparse
+import time
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+# Strategy constants used by the live handlers, per market
+DEFAULT_PARAMS = {
+    "stock": {
+        "sma_window": 20,
+        "rsi_window": 14,
+        "sma_factor": 0.95,
+        "rsi_threshold": 30,
+        "stop_factor": 0.98,
+        "stop_offset": 0.02,
+        "take_profit_factor": 1.02,
+        "bracket_sizing": "atr",
+        "atr_window": 14,
+        "stop_atr": 2.0,
+        "take_profit_atr": 2.0,
+        "min_price": 1.0,
+        "max_price": 5.0,
+        "cash_fraction": 0.1,
+        "session_open": 9 * 60 + 30,
+        "entry_cutoff_minutes": 15,
+    },
+    "crypto": {
+        "sma_window": 20,
+        "rsi_window": 14,
+        "sma_factor": 0.95,
+        "rsi_threshold": 30,
+        "stop_factor": 0.95,
+        "stop_offset": 0.01,
+        "take_profit_factor": 1.02,
+        "bracket_sizing": "atr",
+        "atr_window": 14,
+        "stop_atr": 2.0,
+        "take_profit_atr": 2.0,
+        "min_price": 0.0,
+        "max_price": np.inf,
+        "cash_fraction": 0.1,
+        # Sessions run from one day's flatten to the next
+        "session_open": None,
+        "entry_cutoff_minutes": 15,
+    },
+}
+
+# Positions are flattened an hour before the close, 15:00 US/Eastern on a regular day, and new entries
+# stop `entry_cutoff_minutes` before that, like the live session scheduler
+FLATTEN_MINUTE = 15 * 60
+FLATTEN_BEFORE_CLOSE = 60
+
+
+def load_bars(path) -> pd.DataFrame:
+    """
+    Load minute bars from a Parquet/CSV file or a directory of them.
+
+    Files are expected in the layout of `get_stock_bars(...).df.reset_index()`:
+    symbol, timestamp, open, high, low, close, volume, vwap. Files without a
+    symbol column take the symbol from the file name.
+    """
+    path = Path(path)
+    files = sorted(path.glob("*.parquet")) + sorted(path.glob("*.csv")) if path.is_dir() else [path]
+
+    frames = []
+    for file in files:
+        df = pd.read_parquet(file) if file.suffix == ".parquet" else pd.read_csv(file)
+        if "symbol" not in df.columns:
+            df["symbol"] = file.stem
+        frames.append(df)
+
+    bars = pd.concat(frames, ignore_index=True)
+    bars["timestamp"] = pd.to_datetime(bars["timestamp"], utc=True)
+    return bars
+
+
+def build_panel(bars: pd.DataFrame) -> dict:
+    """
+    Turn long-format bars into (bars x symbols) arrays.
+
+    Row k holds each symbol's k-th bar, so every column is that symbol's own
+    bar sequence, exactly what the live handler would have seen. Shorter
+    columns are padded with NaN at the end.
+    """
+    codes, symbols = pd.factorize(bars["symbol"], sort=True)
+    nanos = bars["timestamp"].dt.tz_convert("UTC").dt.as_unit("ns").dt.tz_localize(None).to_numpy().view(np.int64)
+    order = np.lexsort((nanos, codes))
+    codes, nanos = codes[order], nanos[order]
+    bars = bars.iloc[order]
+
+    counts = np.bincount(codes, minlength=len(symbols))
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    rows = np.arange(len(bars)) - starts[codes]
+    shape = (counts.max(), len(symbols))
+
+    panel = {"symbols": np.asarray(symbols, dtype=object)}
+    for column in ("open", "high", "low", "close", "vwap"):
+        values = np.full(shape, np.nan)
+        values[rows, codes] = bars[column].to_numpy(dtype=float)
+        panel[column] = values
+
+    timestamps = np.full(shape, np.iinfo(np.int64).min, dtype=np.int64)
+    timestamps[rows, codes] = nanos
+    panel["timestamp"] = timestamps
+
+    eastern = bars["timestamp"].dt.tz_convert("US/Eastern")
+    minute = np.full(shape, -1, dtype=np.int16)
+    minute[rows, codes] = (eastern.dt.hour * 60 + eastern.dt.minute).to_numpy()
+    panel["minute"] = minute
+
+    day = np.full(shape, -1, dtype=np.int32)
+    day[rows, codes] = eastern.dt.tz_localize(None).to_numpy().astype("datetime64[D]").astype(np.int32)
+    panel["day"] = day
+
+    panel["valid"] = ~np.isnan(panel["close"])
+    return panel
+
+
+def sma(close: np.ndarray, window: int) -> np.ndarray:
+    """Column-wise SMA; expanding mean before the window fills, like `ta` with fillna=True"""
+    csum = np.cumsum(np.nan_to_num(close), axis=0)
+    shifted = np.zeros_like(csum)
+    shifted[window:] = csum[:-window]
+    counts = np.minimum(np.arange(1, len(close) + 1), window)[:, None]
+    return (csum - shifted) / counts
+
+
+def rsi(close: np.ndarray, window: int) -> np.ndarray:
+    """Column-wise Wilder RSI with the same smoothing and seeding as `ta` with fillna=True"""
+    diff = np.diff(close, axis=0, prepend=close[:1])
+    gains = np.where(diff > 0, diff, 0.0)
+    losses = np.where(diff < 0, -diff, 0.0)
+    avg_gain = pd.DataFrame(gains).ewm(alpha=1 / window, adjust=False).mean().to_numpy()
+    avg_loss = pd.DataFrame(losses).ewm(alpha=1 / window, adjust=False).mean().to_numpy()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values = 100 - 100 / (1 + avg_gain / avg_loss)
+    return np.where(avg_loss == 0, 100.0, values)
+
+
+def atr(high: np.ndarray, low: np.ndarray, close: np.ndarray, window: int) -> np.ndarray:
+    """Column-wise mean true range of the last `window` bars, like `BarBuffer.atr`; NaN on the first bar"""
+    prev_close = np.roll(close, 1, axis=0)
+    ranges = np.maximum(high, prev_close) - np.minimum(low, prev_close)
+    ranges[0] = np.nan
+    return pd.DataFrame(ranges).rolling(window, min_periods=1).mean().to_numpy()
+
+
+def flatten_minutes(panel: dict, closes: dict = None) -> np.ndarray:
+    """
+    Minute of the Eastern day each bar's session flattens at. `closes` maps
+    days (days since the epoch, as in panel["day"]) to their close minute,
+    early closes included; other days close at 16:00.
+    """
+    days = panel["day"]
+    flatten = np.full(days.shape, FLATTEN_MINUTE, dtype=np.int16)
+    if not closes or not (days >= 0).any():
+        return flatten
+    first, last = days[days >= 0].min(), days.max()
+    table = np.full(last - first + 1, FLATTEN_MINUTE, dtype=np.int16)
+    for day, close in closes.items():
+        if first <= day <= last:
+            table[day - first] = close - FLATTEN_BEFORE_CLOSE
+    return np.where(days >= 0, table[np.clip(days - first, 0, len(table) - 1)], flatten)
+
+
+def entry_signals(panel: dict, market: str, params: dict, flatten: np.ndarray = None) -> np.ndarray:
+    close = panel["close"]
+    with np.errstate(invalid="ignore"):
+        signal = (close < sma(close, params["sma_window"]) * params["sma_factor"]) | (
+            rsi(close, params["rsi_window"]) < params["rsi_threshold"]
+        )
+        signal &= (close >= params["min_price"]) & (close <= params["max_price"])
+        if market == "crypto":
+            signal &= close >= panel["vwap"]
+
+    # Matches the handlers' "Not enough data points" warm-up guard
+    signal[: params["sma_window"] - 1] = False
+    minute = panel["minute"]
+    if flatten is None:
+        flatten = flatten_minutes(panel)
+    cutoff = flatten - params["entry_cutoff_minutes"]
+    if params["session_open"] is None:
+        # The next session opens at the flatten
+        entries_open = (minute < cutoff) | (minute >= flatten)
+    else:
+        entries_open = (minute >= params["session_open"]) & (minute < cutoff)
+    return signal & panel["valid"] & entries_open
+
+
+def run_backtest(
+    panel: dict,
+    market: str = "stock",
+    starting_cash: float = 100_000.0,
+    slippage: dict = None,
+    closes: dict = None,
+    **overrides,
+):
+    """
+    Simulate the bracket strategy on a panel.
+
+    Signals are computed for the whole panel at once. The exit simulation
+    walks the rows once with every symbol's position state held in arrays,
+    because a bracket's exit depends on where it was entered. `slippage`
+    maps symbols to a fill cost in basis points, charged on entry and
+    exit; symbols it does not cover pay the average of those it does.
+    `closes` holds the market calendar's close minute per day (see
+    flatten_minutes()), so early closes flatten and stop entries early.
+
+    Returns (trades, summary).
+    """
+    params = {**DEFAULT_PARAMS[market], **overrides}
+    flatten = flatten_minutes(panel, closes)
+    signal = entry_signals(panel, market, params, flatten)
+    cash_per_trade = starting_cash * params["cash_fraction"]
+
+    close, high, low, valid = panel["close"], panel["high"], panel["low"], panel["valid"]
+    with np.errstate(invalid="ignore"):
+        ranges = atr(high, low, close, params["atr_window"])
+    # A session rolls over at the flatten time, so anything held across it gets closed
+    session = panel["day"] + (panel["minute"] >= flatten)
+    n_rows, n_symbols = close.shape
+    symbol_cols = np.arange(n_symbols)
+
+    in_position = np.zeros(n_symbols, dtype=bool)
+    entry_row = np.zeros(n_symbols, dtype=np.int64)
+    stop_loss = np.zeros(n_symbols)
+    take_profit = np.zeros(n_symbols)
+    shares = np.zeros(n_symbols)
+    exits = []
+
+    for k in range(n_rows):
+        # Exits: stop loss first when a bar spans both legs, then take profit, then the flatten rule
+        held = in_position & valid[k]
+        with np.errstate(invalid="ignore"):
+            stopped = held & (low[k] <= stop_loss)
+            took_profit = held & ~stopped & (high[k] >= take_profit)
+            flattened = held & ~stopped & ~took_profit & (session[k] != session[entry_row, symbol_cols])
+        for reason, hit, price in (
+            ("stop_loss", stopped, stop_loss),
+            ("take_profit", took_profit, take_profit),
+            ("flatten", flattened, close[k]),
+        ):
+            if hit.any():
+                cols = np.flatnonzero(hit)
+                exits.append((cols, entry_row[cols], np.full(len(cols), k), price[cols], shares[cols], reason))
+        in_position &= ~(stopped | took_profit | flattened)
+
+        # Entries on the bar close, sized like `cash_per_trade / data.close`
+        enter = signal[k] & ~in_position
+        if enter.any():
+            cols = np.flatnonzero(enter)
+            price = close[k, cols]
+            qty = np.floor(cash_per_trade / price)
+            cols, price, qty = cols[qty > 0], price[qty > 0], qty[qty > 0]
+            in_position[cols] = True
+            entry_row[cols] = k
+            shares[cols] = qty
+            # Sized from the ATR like the live brackets, with the fixed percentages as the fallback
+            entry_atr = ranges[k, cols]
+            sized = (entry_atr > 0) & (params["bracket_sizing"] == "atr")
+            stop_loss[cols] = np.round(
+                np.where(
+                    sized,
+                    np.maximum(np.minimum(price - params["stop_atr"] * entry_atr, price - params["stop_offset"]), 0.01),
+                    np.minimum(price * params["stop_factor"], price - params["stop_offset"]),
+                ),
+                2,
+            )
+            take_profit[cols] = np.round(
+                np.where(
+                    sized,
+                    np.maximum(price + params["take_profit_atr"] * entry_atr, price + 0.01),
+                    np.maximum(price * params["take_profit_factor"], price + 0.01),
+                ),
+                2,
+            )
+
+    # Anything still open is closed at its last bar
+    if in_position.any():
+        cols = np.flatnonzero(in_position)
+        last = valid[:, cols].sum(axis=0) - 1
+        exits.append((cols, entry_row[cols], last, close[last, cols], shares[cols], "end_of_data"))
+
+    trades = trades_frame(panel, exits)
+    if slippage:
+        cost = trades["symbol"].map(slippage).fillna(np.mean(list(slippage.values()))).to_numpy(dtype=float) / 10_000
+        trades["entry_price"] *= 1 + cost
+        trades["exit_price"] *= 1 - cost
+        trades["pnl"] = (trades["exit_price"] - trades["entry_price"]) * trades["shares"]
+    return trades, summarize(trades, starting_cash)
+
+
+def trades_frame(panel: dict, exits: list) -> pd.DataFrame:
+    if not exits:
+        return pd.DataFrame(
+            columns=["symbol", "entry_time", "exit_time", "entry_price", "exit_price", "shares", "pnl", "reason"]
+        )
+
+    cols, entry_rows, exit_rows, exit_price, shares = (
+        np.concatenate([e[i] for e in exits]) for i in range(5)
+    )
+    reason = np.concatenate([np.full(len(e[0]), e[5]) for e in exits])
+    entry_price = panel["close"][entry_rows, cols]
+
+    trades = pd.DataFrame(
+        {
+            "symbol": panel["symbols"][cols],
+            "entry_time": pd.to_datetime(panel["timestamp"][entry_rows, cols], utc=True),
+            "exit_time": pd.to_datetime(panel["timestamp"][exit_rows, cols], utc=True),
+            "entry_price": entry_price,
+            "exit_price": exit_price,
+            "shares": shares,
+            "pnl": (exit_price - entry_price) * shares,
+            "reason": reason,
+        }
+    )
+    return trades.sort_values("exit_time", kind="stable", ignore_index=True)
+
+
+def summarize(trades: pd.DataFrame, starting_cash: float) -> dict:
+    """Total P&L, win rate and max drawdown of the realized equity curve"""
+    pnl = trades["pnl"].to_numpy(dtype=float)
+    equity = starting_cash + np.cumsum(pnl)
+    peak = np.maximum.accumulate(np.concatenate(([starting_cash], equity)))[1:]
+    drawdown = (peak - equity) if len(equity) else np.zeros(1)
+    return {
+        "trades": len(trades),
+        "total_pnl": float(pnl.sum()),
+        "win_rate": float((pnl > 0).mean()) if len(pnl) else 0.0,
+        "max_drawdown": float(drawdown.max()),
+        "max_drawdown_pct": float((drawdown / np.maximum(peak, 1e-9)).max()) if len(equity) else 0.0,
+        "final_equity": float(equity[-1]) if len(equity) else starting_cash,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backtest the SMA/RSI bracket strategy on local minute bars")
+    parser.add_argument("market_type", choices=["crypto", "stock"], help="Strategy variant to simulate")
+    parser.add_argument("bars", help="Parquet/CSV file or directory of minute bars")
+    parser.add_argument("--cash", type=float, default=100_000.0, help="Starting account balance")
+    parser.add_argument("--trades-out", help="Write the trade list to this CSV file")
+    parser.add_argument("--slippage", help="Charge the per-symbol fill costs the live bot recorded (slippage JSON)")
+    parser.add_argument("--calendar", action="store_true", help="Take early closes from the Alpaca market calendar")
+    args = parser.parse_args()
+
+    slippage = None
+    if args.slippage:
+        from execution import load_fills
+
+        slippage = {
+            symbol: row["cost"] / row["notional"] for symbol, row in load_fills(args.slippage).items() if row["notional"]
+        }
+
+    start = time.perf_counter()
+    panel = build_panel(load_bars(args.bars))
+    loaded = time.perf_counter()
+
+    closes = None
+    if args.calendar:
+        from alpaca.trading.requests import GetCalendarRequest
+        from make_orders import get_trading_client
+
+        days = panel["day"][panel["day"] >= 0]
+        first, last = (np.datetime64(int(day), "D").astype(object) for day in (days.min(), days.max()))
+        calendar = get_trading_client().get_calendar(GetCalendarRequest(start=first, end=last))
+        # Calendar times are Eastern wall-clock times
+        closes = {
+            int(np.datetime64(day.date, "D").astype(np.int32)): day.close.hour * 60 + day.close.minute
+            for day in calendar
+        }
+
+    trades, summary = run_backtest(
+        panel, args.market_type, starting_cash=args.cash, slippage=slippage, closes=closes
+    )
+    finished = time.perf_counter()
+
+    print(f"Loaded {panel['valid'].sum()} bars for {len(panel['symbols'])} symbols in {loaded - start:.2f}s")
+    print(f"Simulated in {finished - loaded:.2f}s")
+    for key, value in summary.items():
+        print(f"{key:<18} {value:,.4f}" if isinstance(value, float) else f"{key:<18} {value}")
+    if args.trades_out:
+        trades.to_csv(args.trades_out, index=False)
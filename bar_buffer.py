@@ -0,0 +1,77 @@
+import math
+from collections import deque
+from datetime import timedelta
+
+
+class BarBuffer:
+    """Rolling window of recent minute bars for every subscribed symbol"""
+
+    def __init__(self, minutes: int):
+        self.window = timedelta(minutes=minutes)
+        self.maxlen = minutes + 1
+        self._bars = {}
+
+    def __contains__(self, symbol):
+        return symbol in self._bars
+
+    def __len__(self):
+        return len(self._bars)
+
+    def symbols(self):
+        return list(self._bars)
+
+    def warm_up(self, bars_by_symbol: dict):
+        """Seed the buffer from a batched history response (`BarSet.data`)"""
+        for symbol, bars in bars_by_symbol.items():
+            for bar in bars:
+                self.append(bar, symbol)
+
+    def append(self, bar, symbol: str = None):
+        """Add a streamed bar, replacing the last one if it has the same timestamp"""
+        symbol = symbol or bar.symbol
+        bars = self._bars.get(symbol)
+        if bars is None:
+            bars = self._bars[symbol] = deque(maxlen=self.maxlen)
+
+        if bars and bars[-1].timestamp == bar.timestamp:
+            bars[-1] = bar
+        elif bars and bars[-1].timestamp > bar.timestamp:
+            return
+        else:
+            bars.append(bar)
+
+        # Keep only the bars inside the time window, like the old REST lookback
+        cutoff = bar.timestamp - self.window
+        while bars[0].timestamp < cutoff:
+            bars.popleft()
+
+    def merge(self, symbol: str, bars):
+        """Fold in history bars for minutes the stream missed; a streamed bar wins over its history copy"""
+        if symbol not in self._bars:
+            return
+        merged = {bar.timestamp: bar for bar in bars}
+        merged.update((bar.timestamp, bar) for bar in self._bars[symbol])
+        del self._bars[symbol]
+        for timestamp in sorted(merged):
+            self.append(merged[timestamp], symbol)
+
+    def bars(self, symbol: str):
+        return list(self._bars.get(symbol, ()))
+
+    def closes(self, symbol: str):
+        return [bar.close for bar in self._bars.get(symbol, ())]
+
+    def atr(self, symbol: str, window: int = 14) -> float:
+        """Mean true range of the last `window` bars; NaN until there are two bars"""
+        bars = self._bars.get(symbol, ())
+        if len(bars) < 2:
+            return math.nan
+        recent = list(bars)[-window - 1 :]
+        ranges = [
+            max(bar.high, prev.close) - min(bar.low, prev.close)
+            for prev, bar in zip(recent, recent[1:])
+        ]
+        return sum(ranges) / len(ranges)
+
+    def drop(self, symbol: str):
+        self._bars.pop(symbol, None)
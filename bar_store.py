@@ -0,0 +1,214 @@
+import argparse
+import json
+import os
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+import numpy as np
+from parameters import BAR_CACHE_DIR
+
+BAR_DTYPE = np.dtype(
+    [
+        ("timestamp", "i8"),
+        ("open", "f8"),
+        ("high", "f8"),
+        ("low", "f8"),
+        ("close", "f8"),
+        ("volume", "f8"),
+        ("vwap", "f8"),
+    ]
+)
+
+# Symbols per multi-symbol history request
+CHUNK_SIZE = 100
+
+StoredBar = namedtuple("StoredBar", "symbol timestamp open high low close volume vwap")
+
+
+def plain(bar) -> StoredBar:
+    """A small picklable copy of a stream bar"""
+    return StoredBar(bar.symbol, bar.timestamp, bar.open, bar.high, bar.low, bar.close, bar.volume, bar.vwap)
+
+
+def _epoch(dt: datetime) -> int:
+    if dt.tzinfo is None:
+        dt = dt.astimezone()
+    return int(dt.timestamp())
+
+
+def _records(bars) -> np.ndarray:
+    return np.array(
+        [(_epoch(b.timestamp), b.open, b.high, b.low, b.close, b.volume, b.vwap or b.close) for b in bars],
+        dtype=BAR_DTYPE,
+    )
+
+
+class BarStore:
+    """
+    Minute bars cached on disk as one .npy file per symbol and UTC day.
+
+    `coverage.json` records the span already fetched for each symbol, so a
+    later load only requests the tail that is missing. Requests are batched
+    across symbols in chunks of CHUNK_SIZE.
+    """
+
+    def __init__(self, market, root=BAR_CACHE_DIR):
+        self.market = market
+        self.root = Path(root) / market.name
+        self._lock = threading.Lock()
+        self._coverage_path = self.root / "coverage.json"
+        self.coverage = (
+            json.loads(self._coverage_path.read_text()) if self._coverage_path.exists() else {}
+        )
+
+    def _path(self, symbol: str, day) -> Path:
+        return self.root / day.isoformat() / f"{symbol.replace('/', '-')}.npy"
+
+    def read(self, symbol: str, start: int, end: int) -> np.ndarray:
+        """Cached bars for a symbol with start <= timestamp <= end (epoch seconds)"""
+        day = datetime.fromtimestamp(start, timezone.utc).date()
+        last_day = datetime.fromtimestamp(end, timezone.utc).date()
+        parts = []
+        while day <= last_day:
+            path = self._path(symbol, day)
+            if path.exists():
+                parts.append(np.load(path, mmap_mode="r"))
+            day += timedelta(days=1)
+        if not parts:
+            return np.empty(0, dtype=BAR_DTYPE)
+        records = np.concatenate(parts)
+        return records[(records["timestamp"] >= start) & (records["timestamp"] <= end)]
+
+    def write(self, symbol: str, records: np.ndarray):
+        """Merge records into the per-day files, newest copy of a timestamp winning"""
+        days = records["timestamp"] // 86400
+        for day_number in np.unique(days):
+            day = datetime.fromtimestamp(int(day_number) * 86400, timezone.utc).date()
+            path = self._path(symbol, day)
+            new = records[days == day_number]
+            if path.exists():
+                new = np.concatenate([new, np.load(path)])
+            _, first = np.unique(new["timestamp"], return_index=True)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(".tmp")
+            with open(tmp, "wb") as f:
+                np.save(f, new[first])
+            os.replace(tmp, path)
+
+    def _tail_start(self, symbol: str, start: int) -> int:
+        covered = self.coverage.get(symbol)
+        if covered and covered[0] <= start <= covered[1]:
+            return covered[1]
+        return start
+
+    def fetch(self, symbols, start: datetime, end: datetime = None):
+        """Download whatever is missing for `symbols` between start and end"""
+        start_ts = _epoch(start)
+        tails = sorted((self._tail_start(s, start_ts), s) for s in symbols)
+
+        for i in range(0, len(tails), CHUNK_SIZE):
+            chunk = tails[i : i + CHUNK_SIZE]
+            chunk_start = datetime.fromtimestamp(chunk[0][0], timezone.utc)
+            fetched = self.market.get_bars([s for _, s in chunk], chunk_start, end)
+
+            with self._lock:
+                for tail, symbol in chunk:
+                    records = _records(fetched.get(symbol, []))
+                    if len(records):
+                        self.write(symbol, records)
+                    covered = self.coverage.get(symbol)
+                    covered_from = covered[0] if covered and tail != start_ts else start_ts
+                    covered_to = int(records["timestamp"].max()) if len(records) else tail
+                    self.coverage[symbol] = [covered_from, covered_to]
+                self._save_coverage()
+
+    def append(self, bars_by_symbol: dict):
+        """
+        Persist bars seen live and extend each symbol's coverage to its newest
+        bar. Callers backfill detected gaps first, so the span stays complete.
+        """
+        with self._lock:
+            for symbol, bars in bars_by_symbol.items():
+                records = _records(bars)
+                if not len(records):
+                    continue
+                self.write(symbol, records)
+                covered = self.coverage.get(symbol)
+                last = int(records["timestamp"].max())
+                if covered:
+                    self.coverage[symbol] = [covered[0], max(covered[1], last)]
+            self._save_coverage()
+
+    def fetch_range(self, symbols, start: datetime, end: datetime = None) -> dict:
+        """Download [start, end] for `symbols` regardless of coverage, store it and return it"""
+        fetched = {}
+        symbols = list(symbols)
+        for i in range(0, len(symbols), CHUNK_SIZE):
+            chunk = self.market.get_bars(symbols[i : i + CHUNK_SIZE], start, end)
+            with self._lock:
+                for symbol, bars in chunk.items():
+                    records = _records(bars)
+                    if len(records):
+                        self.write(symbol, records)
+                        fetched[symbol] = self.bars(symbol, records)
+        return fetched
+
+    def _save_coverage(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self._coverage_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.coverage))
+        os.replace(tmp, self._coverage_path)
+
+    def load(self, symbols, start: datetime, end: datetime = None) -> dict:
+        """Bars for `symbols` from the cache, fetching only the missing tail first"""
+        self.fetch(symbols, start, end)
+        start_ts = _epoch(start)
+        end_ts = _epoch(end) if end else _epoch(datetime.now(timezone.utc))
+        return {symbol: self.bars(symbol, self.read(symbol, start_ts, end_ts)) for symbol in symbols}
+
+    @staticmethod
+    def bars(symbol: str, records: np.ndarray):
+        return [
+            StoredBar(symbol, datetime.fromtimestamp(int(r["timestamp"]), timezone.utc), *r.tolist()[1:])
+            for r in records
+        ]
+
+    def frame(self, symbols, start: datetime, end: datetime):
+        """Cached bars in the backtest's long layout"""
+        import pandas as pd
+
+        frames = []
+        for symbol in symbols:
+            df = pd.DataFrame(self.read(symbol, _epoch(start), _epoch(end)))
+            df["symbol"] = symbol
+            frames.append(df)
+        df = pd.concat(frames, ignore_index=True)
+        df["timestamp"] = pd.to_datetime(df["timestamp"], unit="s", utc=True)
+        return df
+
+
+if __name__ == "__main__":
+    from markets import MARKETS
+
+    parser = argparse.ArgumentParser(description="Fill the local bar cache and optionally export it for backtests")
+    parser.add_argument("market_type", choices=["crypto", "stock"], help="Market to fetch")
+    parser.add_argument("symbols", nargs="*", help="Symbols to fetch (default: current movers)")
+    parser.add_argument("--days", type=int, default=5, help="Days of history to keep cached")
+    parser.add_argument("--export", help="Write the cached bars to this CSV/Parquet file")
+    args = parser.parse_args()
+
+    market = MARKETS[args.market_type]
+    symbols = args.symbols
+    if not symbols:
+        gainers, losers = market.get_movers()
+        symbols = [mover["symbol"] for mover in gainers + losers]
+
+    end = datetime.now(timezone.utc)
+    start = end - timedelta(days=args.days)
+    store = BarStore(market)
+    store.fetch(symbols, start)
+    if args.export:
+        df = store.frame(symbols, start, end)
+        df.to_parquet(args.export) if args.export.endswith(".parquet") else df.to_csv(args.export, index=False)
+        print(f"Exported {len(df)} bars to {args.export}")
@@ -0,0 +1,431 @@
+import asyncio
+import copy
+import logging
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+from alpaca.trading.enums import OrderSide
+from bar_buffer import BarBuffer
+from bar_store import BarStore, StoredBar
+from execution import Execution
+from indicators import Indicators, warm_up as warm_up_indicators
+from make_orders import order_executor
+from log import decisions, fields, log_decision, setup_logging
+from markets import MARKETS
+from parameters import ATR_WINDOW, BATCH_SCAN, MAX_SPREAD_BPS, MICROSTRUCTURE, WORKERS
+import metrics
+from order_gateway import order_gateway
+from positions import position_book, start_trade_updates
+from risk import risk
+from scan import CrossSectionScan
+from session import SessionScheduler
+from state_store import StateStore, state_path
+from stream_runner import StreamRunner, load_checkpoint
+from tasks import concurrent_handler, spawn
+from ticks import TickBook
+from universe import UniverseManager
+
+
+class StartupTimer:
+    """Wall time of each cold-start stage, reported once the bars are subscribed"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        yield
+        self.stages.append((name, time.perf_counter() - start))
+
+    def report(self):
+        stages = {name: round(seconds * 1000, 1) for name, seconds in self.stages}
+        total = round((time.perf_counter() - self.started) * 1000, 1)
+        logger.info("startup timing (ms)", extra=fields(**stages, total=total))
+
+
+logger = logging.getLogger("engine")
+
+# Per-bar stages; the history fetch is timed per universe update
+STAGE_INDICATORS = metrics.stage_histogram("indicators")
+STAGE_POSITION = metrics.stage_histogram("position")
+STAGE_DECISION = metrics.stage_histogram("decision")
+STAGE_ORDER = metrics.stage_histogram("order")
+STAGE_HISTORY = metrics.stage_histogram("history")
+
+ONE_MINUTE = timedelta(minutes=1)
+
+WIDE_SPREAD = metrics.registry.counter("entries_wide_spread_total", "Entries skipped because the quote was too wide")
+
+
+class Engine:
+    """The per-bar strategy shared by every market; market specifics come from the adapter"""
+
+    def __init__(self, market, microstructure=False, batch=False):
+        self.market = market
+        self.bars = BarBuffer(minutes=market.lookback_minutes)
+        self.store = BarStore(market)
+        self.orders = order_gateway
+        self.indicators = {}
+        # The universe; bars still in flight for symbols dropped from it are ignored
+        self.symbols = set()
+        # symbol -> indicator state as of the bar before a jump in timestamps, until the gap is backfilled
+        self._before_gap = {}
+        # Trades and quotes, only kept in microstructure mode
+        self.ticks = TickBook() if microstructure else None
+        self.execution = Execution(market, self.ticks)
+        # Whole-minute decisions, only in batch mode
+        self.scanner = CrossSectionScan(self) if batch else None
+        self.risk = risk
+        self.state = StateStore(state_path(market.name))
+        self.runner = StreamRunner(self)
+        self.session = SessionScheduler(self)
+        # Set by the session events, so bars never look at the clock
+        self.entries_open = False
+        self.session_over = False
+        self._account = None
+
+    def warm_up(self, symbols):
+        """Load the lookback window from the bar cache, fetching only what is missing"""
+        self.adopt(*self.history(symbols))
+
+    def history(self, symbols):
+        """
+        The lookback window of `symbols` and their indicator checkpoints.
+        Only reads the bar and state stores, so it runs off the stream's loop.
+        """
+        start = time.perf_counter()
+        bars = self.store.load(symbols, self.market.history_start())
+        STAGE_HISTORY.observe(time.perf_counter() - start)
+        return bars, self.state.load_indicators(bars)
+
+    def adopt(self, bars, states):
+        """Start trading the symbols of a history response; runs on the stream's loop once it is up"""
+        self.symbols.update(bars)
+        self.runner.seed(bars)
+        self.load_state(bars, states)
+
+    def load_state(self, bars, states):
+        """Restore indicator checkpoints that line up with `bars`, then apply the bars after them"""
+        for symbol, state in states.items():
+            symbol_bars = bars[symbol]
+            # Older checkpoints would skip the minutes between them and the window
+            if symbol_bars and state.timestamp >= symbol_bars[0].timestamp - timedelta(minutes=1):
+                self.indicators[symbol] = state
+        self.bars.warm_up(bars)
+        warm_up_indicators(self.indicators, bars)
+
+    def checkpoint_state(self):
+        self.state.save_indicators(self.indicators)
+
+    def drop(self, symbol):
+        """Forget the state of a symbol that left the universe"""
+        self.symbols.discard(symbol)
+        self.bars.drop(symbol)
+        self.indicators.pop(symbol, None)
+        self._before_gap.pop(symbol, None)
+        self.runner.forget(symbol)
+        if self.ticks is not None:
+            self.ticks.drop(symbol)
+
+    def backfill(self, bars_by_symbol):
+        """
+        Fold in the bars history had for minutes the stream skipped. A symbol
+        listed with no bars just didn't trade, and keeps its state. Otherwise
+        its indicators are replayed from the state before the jump, as long
+        as every bar streamed since is still in the window.
+        """
+        for symbol, missing in bars_by_symbol.items():
+            before = self._before_gap.pop(symbol, None)
+            if not missing or symbol not in self.bars:
+                continue
+            streamed = [] if before is None else [b for b in self.bars.bars(symbol) if b.timestamp > before.timestamp]
+            self.bars.merge(symbol, missing)
+            current = self.indicators.get(symbol)
+            if before is None or current is None or len(streamed) != current.count - before.count:
+                # Without every bar since the jump, the state that skipped the gap is the closer one
+                continue
+            replay = {bar.timestamp: bar for bar in missing}
+            replay.update((bar.timestamp, bar) for bar in streamed)
+            for timestamp in sorted(replay):
+                before.update(replay[timestamp])
+            self.indicators[symbol] = before
+
+    def on_stream_restart(self):
+        """Called between a stream stopping unexpectedly and its restart"""
+
+    def settled(self) -> bool:
+        """Whether every bar received so far has been through update()"""
+        return True
+
+    def update(self, data):
+        """Feed a bar to the rolling window and indicators; (sma, rsi) if it can be traded on"""
+        self.bars.append(data)
+        indicators = self.indicators.get(data.symbol)
+        if indicators is None:
+            indicators = self.indicators[data.symbol] = Indicators()
+        elif (
+            indicators.timestamp is not None
+            and data.timestamp - indicators.timestamp > ONE_MINUTE
+            and data.symbol not in self._before_gap
+        ):
+            # Kept so a backfill can replay the missed minutes in order
+            self._before_gap[data.symbol] = copy.deepcopy(indicators)
+        indicators.update(data)
+        if not self.market.accepts(data) or indicators.count < 20:
+            return None
+        return indicators.sma.value, indicators.rsi.value
+
+    async def on_bar(self, data):
+        if data.symbol not in self.symbols:
+            return
+        try:
+            metrics.bars_received.inc()
+            self.runner.observe(data)
+            if self.scanner is not None:
+                self.scanner.seen(data)
+            start = time.perf_counter()
+            inputs = self.update(data)
+            STAGE_INDICATORS.observe(time.perf_counter() - start)
+
+            if not self.market.accepts(data):
+                metrics.bars_filtered.inc()
+                return
+
+            if inputs is None:
+                logger.debug("not enough data points", extra=fields(symbol=data.symbol))
+                return
+
+            if self.scanner is not None:
+                self.scanner.ready(data, *inputs)
+                return
+            # Minute bars are stamped with their open, so the bar closed a minute later
+            metrics.decision_lag.observe(time.time() - data.timestamp.timestamp() - 60)
+            await self.act(data, *inputs)
+
+        except Exception:
+            logger.exception("error processing bar", extra=fields(symbol=data.symbol))
+        finally:
+            if self.scanner is not None:
+                self.scanner.check()
+
+    async def act(self, data, current_smma, current_rsi):
+        """Trading decision for a bar whose indicators are ready"""
+        # Check existing position
+        start = time.perf_counter()
+        has_position, qty = position_book.position(data.symbol)
+        STAGE_POSITION.observe(time.perf_counter() - start)
+
+        # Built only when decision logging is on and this bar is sampled
+        if log_decision(data.symbol):
+            decisions.debug("decision", extra={"fields": self.market.describe_decision(data, current_smma, current_rsi)})
+
+        # Trading logic
+        start = time.perf_counter()
+        enter = self.market.entry_signal(data, current_smma, current_rsi)
+        STAGE_DECISION.observe(time.perf_counter() - start)
+
+        if enter:
+            await self.enter(data)
+
+        elif has_position and position_book.entry_price(data.symbol) is not None:
+            await self.consider_exit(data, current_smma, qty)
+
+    async def enter(self, data):
+        """Size, approve and submit an entry signal"""
+        if not self.risk.ready:
+            await self.account_ready()
+        shares = self.approve_entry(data)
+        if shares:
+            await self.submit_entry(data, shares)
+
+    async def account_ready(self):
+        """Wait for the first account snapshot, which sizing needs"""
+        try:
+            await asyncio.wrap_future(self._account)
+        except Exception:
+            # Retry the fetch on the next signal instead of failing forever
+            self._account = order_executor.submit(self.risk.refresh)
+            raise
+
+    def approve_entry(self, data) -> int:
+        """Shares to buy on an entry signal, reserved with the risk manager; 0 if the entry is blocked"""
+        if not self.entries_open:
+            blocked = "session"
+        else:
+            self.risk.mark(data.symbol, data.close)
+            shares = self.risk.size(data.close)
+            if self.ticks is not None and self.ticks.spread_bps(data.symbol) > MAX_SPREAD_BPS:
+                WIDE_SPREAD.inc()
+                blocked = "wide_spread"
+            elif shares <= 0:
+                blocked = "no_cash"
+            else:
+                blocked = self.risk.check_entry(data.symbol, shares, data.close)
+        if blocked:
+            logger.debug("entry blocked", extra=fields(symbol=data.symbol, reason=blocked))
+            return 0
+        self.risk.reserve(data.symbol, shares * data.close)
+        return shares
+
+    async def submit_entry(self, data, shares: int):
+        start = time.perf_counter()
+        limit_price = await self.execution.limit_price(data.symbol, OrderSide.BUY, data.close)
+        # Bracket legs are validated against the price the order goes in at
+        stop_loss, take_profit = self.market.bracket(limit_price or data.close, self.atr(data.symbol))
+        logger.info(
+            "entry signal",
+            extra=fields(
+                symbol=data.symbol,
+                close=data.close,
+                limit_price=limit_price,
+                stop_loss=stop_loss,
+                take_profit=take_profit,
+            ),
+        )
+        client_order_id = uuid4().hex
+        order = await self.orders.submit_entry(
+            data.symbol, shares, OrderSide.BUY, take_profit, stop_loss, limit_price, client_order_id
+        )
+        STAGE_ORDER.observe(time.perf_counter() - start)
+        if order is not None:
+            self.execution.expect(client_order_id, data.symbol, OrderSide.BUY, data.close)
+            logger.info("entry submitted", extra=fields(symbol=data.symbol, qty=shares, order_id=order.id))
+        else:
+            self.risk.release(data.symbol)
+
+    def atr(self, symbol: str) -> float:
+        """Average true range the brackets of an entry are sized from"""
+        return self.bars.atr(symbol, ATR_WINDOW)
+
+    async def consider_exit(self, data, sma, qty):
+        self.risk.mark(data.symbol, data.close)
+        # Average fill price tracked from trade updates
+        purchase_price = position_book.entry_price(data.symbol)
+        if self.market.exit_signal(data, sma, purchase_price):
+            logger.info("exit signal", extra=fields(symbol=data.symbol, close=data.close, entry_price=purchase_price))
+            await self.submit_exit(data, qty)
+
+    async def submit_exit(self, data, qty):
+        start = time.perf_counter()
+        limit_price = await self.execution.limit_price(data.symbol, OrderSide.SELL, data.close)
+        client_order_id = uuid4().hex
+        order = await self.orders.submit_exit(data.symbol, int(qty), OrderSide.SELL, limit_price, client_order_id)
+        STAGE_ORDER.observe(time.perf_counter() - start)
+        if order is not None:
+            self.execution.expect(client_order_id, data.symbol, OrderSide.SELL, data.close)
+
+    async def on_trade(self, trade):
+        """
+        Microstructure mode: fold a trade into its second bar and, once a
+        second completes, evaluate it against the minute indicators. Runs
+        inline on the stream's loop; only decisions get a task.
+        """
+        if trade.symbol not in self.symbols:
+            return
+        metrics.ticks_received.inc()
+        completed = self.ticks.on_trade(trade.symbol, trade.timestamp.timestamp(), trade.price, trade.size)
+        if completed is None:
+            return
+        indicators = self.indicators.get(trade.symbol)
+        if indicators is None or indicators.count < 20:
+            return
+        second, ohlcv = completed
+        bar = StoredBar(
+            trade.symbol, datetime.fromtimestamp(second, timezone.utc), *ohlcv, self.ticks.vwap(trade.symbol)
+        )
+        if self.market.accepts(bar):
+            metrics.decision_lag.observe(time.time() - second - 1)
+            spawn(self.act_logged(bar, indicators.sma.value, indicators.rsi.value))
+
+    async def act_logged(self, data, sma, rsi):
+        """act() in a task of its own, where nothing else would log its errors"""
+        try:
+            await self.act(data, sma, rsi)
+        except Exception:
+            logger.exception("error processing bar", extra=fields(symbol=data.symbol))
+
+    async def on_quote(self, quote):
+        if quote.symbol not in self.symbols:
+            return
+        metrics.ticks_received.inc()
+        self.ticks.on_quote(quote.symbol, quote.bid_price, quote.ask_price)
+
+    def handler(self):
+        """The callback subscribed to the stream"""
+        return concurrent_handler(self.on_bar)
+
+    # Session events, run on the stream's loop by the scheduler
+
+    async def on_session_open(self):
+        self.entries_open = True
+
+    async def on_session_cutoff(self):
+        self.entries_open = False
+
+    async def on_session_flatten(self):
+        logger.info("session closed, flattening all positions")
+        await self.orders.flatten()
+        logger.info("all positions closed", extra=fields(**self.orders.stats()))
+
+    async def on_session_shutdown(self):
+        logger.info("session over, exiting")
+        self.session_over = True
+        await self.market.stream.stop_ws()
+
+    def run(self):
+        try:
+            setup_logging(self.market.name)
+            timer = StartupTimer()
+            metrics.start_server()
+            # The account snapshot is only needed to size the first order, so fetch it in the background
+            self._account = order_executor.submit(self.risk.refresh)
+
+            # Trade updates and reconciles are applied on the stream's loop, where decisions read the book
+            position_book.dispatch = self.runner.call
+            with timer.stage("movers + positions"):
+                self.state.restore_book(position_book)
+                self.state.attach(position_book)
+                self.execution.fills.attach(position_book)
+                order_executor.submit(self.state.compact)
+                positions = order_executor.submit(start_trade_updates)
+                schedule = order_executor.submit(self.session.plan)
+                resumed = load_checkpoint(self.store)
+                if resumed:
+                    # Restarted mid-session: keep the same universe and skip the screener
+                    logger.info("resuming from checkpoint", extra=fields(symbols=len(resumed)))
+                    movers = [{"symbol": symbol} for symbol in resumed]
+                else:
+                    gainers, losers = self.market.get_movers()
+                    movers = gainers + losers
+                positions.result()
+                schedule.result()
+            with timer.stage("warm-up + subscribe"):
+                universe = UniverseManager(self, self.handler())
+                universe.update(movers, limit=False)
+                logger.info("subscribed", extra=fields(symbols=universe.symbols))
+            timer.report()
+
+            universe.start()
+            self.risk.start()
+            self.runner.run()
+            self.runner.flush()
+            universe.stop()
+            self.risk.stop()
+        except Exception:
+            logger.exception("error in trading loop", extra=fields(market=self.market.name))
+
+
+def run(market_type: str, workers: int = WORKERS, microstructure: bool = MICROSTRUCTURE, batch: bool = BATCH_SCAN):
+    if microstructure and workers > 1:
+        # Trades and quotes need the indicators next to them, on the stream's loop
+        logger.warning("microstructure mode runs in one process, ignoring workers", extra=fields(workers=workers))
+        workers = 1
+    if workers > 1:
+        from supervisor import ShardedEngine
+
+        ShardedEngine(MARKETS[market_type], workers, batch).run()
+    else:
+        Engine(MARKETS[market_type], microstructure, batch).run()
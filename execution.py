@@ -0,0 +1,166 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from alpaca.trading.enums import OrderSide, TradeEvent
+from log import fields
+from make_orders import order_executor
+from parameters import ENTRY_ORDER_TYPE, MARKETABLE_OFFSET_BPS, STATE_DIR
+from positions import CLOSED_EVENTS
+
+logger = logging.getLogger("execution")
+
+ORDER_TYPES = ("market", "limit", "marketable")
+
+
+def round_price(price: float) -> float:
+    # Alpaca only takes sub-penny limit prices below $1
+    return round(price, 2 if price >= 1 else 4)
+
+
+class Execution:
+    """
+    Turns a decision into an order price.
+
+    Market entries go out as before. Limit entries rest at the quote mid;
+    marketable limits reach `offset_bps` past the far side of the quote, so
+    they fill like a market order but never at any price. The quote comes
+    from the tick book in microstructure mode and from the REST latest
+    quote otherwise; without a usable quote the decision price stands in.
+    Exits use the same order type, priced against the bid.
+    """
+
+    def __init__(self, market, ticks=None, order_type=ENTRY_ORDER_TYPE, offset_bps=MARKETABLE_OFFSET_BPS, fills=None):
+        if order_type not in ORDER_TYPES:
+            raise ValueError(f"order type must be one of {ORDER_TYPES}, not {order_type!r}")
+        self.market = market
+        self.ticks = ticks
+        self.order_type = order_type
+        self.offset = offset_bps / 10_000
+        self.fills = fills if fills is not None else FillTracker(slippage_path(market.name))
+
+    async def quote(self, symbol, price: float):
+        """(bid, ask) for pricing an order, falling back to the decision price"""
+        bid = ask = math.nan
+        if self.ticks is not None and symbol in self.ticks:
+            stats = self.ticks.spread_stats(symbol)
+            bid, ask = stats["bid"], stats["ask"]
+        else:
+            try:
+                loop = asyncio.get_running_loop()
+                bid, ask = await loop.run_in_executor(order_executor, self.market.latest_quote, symbol)
+            except Exception:
+                logger.warning("latest quote unavailable", extra=fields(symbol=symbol), exc_info=True)
+        if not (bid > 0 and ask >= bid):
+            return price, price
+        return bid, ask
+
+    async def limit_price(self, symbol, side, price: float):
+        """The limit for an order on `symbol`, or None for a market order"""
+        if self.order_type == "market":
+            return None
+        bid, ask = await self.quote(symbol, price)
+        if self.order_type == "limit":
+            return round_price((bid + ask) / 2)
+        if side == OrderSide.BUY:
+            return round_price(ask * (1 + self.offset))
+        return round_price(bid * (1 - self.offset))
+
+    def expect(self, client_order_id, symbol, side, price: float):
+        """Measure the fills of a submitted order against `price`"""
+        self.fills.expect(client_order_id, symbol, side, price)
+
+
+class FillTracker:
+    """
+    Fill quality per symbol: every fill of our own orders against the price
+    the decision was made at. Slippage is in basis points of that price and
+    positive when it cost us. The per-symbol totals are rewritten to
+    `path` after each fill and picked up again on restart, so the file
+    keeps growing into a fill-cost table for the backtest.
+
+    Orders are only expected once their submit succeeded. A fill can beat
+    the REST response, so fills of orders not expected yet are held back,
+    for the last `early` such orders.
+    """
+
+    def __init__(self, path, early=256):
+        self.path = Path(path)
+        # client order id -> (symbol, side, decision price)
+        self.pending = {}
+        # client order id -> fills that arrived before the order was expected
+        self.early = OrderedDict()
+        self.early_limit = early
+        # symbol -> {"fills", "notional", "cost"}; cost is the notional-weighted slippage
+        self.symbols = load_fills(self.path)
+        self._lock = threading.Lock()
+
+    def expect(self, client_order_id, symbol, side, price):
+        with self._lock:
+            self.pending[client_order_id] = (symbol, side, price)
+            early = self.early.pop(client_order_id, ())
+        for data in early:
+            self.on_trade_update(data)
+
+    def attach(self, book):
+        book.listeners.append(self.on_trade_update)
+
+    def on_trade_update(self, data):
+        client_order_id = data.order.client_order_id
+        filled = data.event in (TradeEvent.FILL, TradeEvent.PARTIAL_FILL)
+        with self._lock:
+            expected = self.pending.get(client_order_id)
+            if expected is None:
+                if filled:
+                    self.early.setdefault(client_order_id, []).append(data)
+                    while len(self.early) > self.early_limit:
+                        self.early.popitem(last=False)
+                return
+        symbol, side, decision = expected
+        if filled and data.price is not None:
+            fill = float(data.price)
+            notional = float(data.qty or 0) * fill
+            sign = 1 if side == OrderSide.BUY else -1
+            slippage = sign * (fill - decision) / decision * 10_000
+            with self._lock:
+                stats = self.symbols.setdefault(symbol, {"fills": 0, "notional": 0.0, "cost": 0.0})
+                stats["fills"] += 1
+                stats["notional"] += notional
+                stats["cost"] += slippage * notional
+            logger.info("fill", extra=fields(symbol=symbol, price=fill, decision=decision, slippage_bps=round(slippage, 2)))
+            order_executor.submit(self.save)
+        if data.event in CLOSED_EVENTS:
+            with self._lock:
+                self.pending.pop(client_order_id, None)
+
+    def slippage_bps(self, symbol) -> float:
+        stats = self.symbols.get(symbol)
+        return stats["cost"] / stats["notional"] if stats and stats["notional"] else math.nan
+
+    def save(self):
+        with self._lock:
+            rows = {
+                symbol: {**stats, "slippage_bps": stats["cost"] / stats["notional"] if stats["notional"] else 0.0}
+                for symbol, stats in self.symbols.items()
+            }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(rows, indent=1, sort_keys=True))
+        os.replace(tmp, self.path)
+
+
+def slippage_path(market_name: str) -> Path:
+    return Path(STATE_DIR) / f"slippage-{market_name}.json"
+
+
+def load_fills(path) -> dict:
+    """Per-symbol fill totals written by FillTracker.save(); empty if there are none yet"""
+    path = Path(path)
+    if not path.exists():
+        return {}
+    rows = json.loads(path.read_text())
+    return {symbol: {key: row[key] for key in ("fills", "notional", "cost")} for symbol, row in rows.items()}
@@ -1,44 +1,78 @@
-import requests
-from alpaca.data.requests import ScreenerRequest, NewsRequest
-import json
-from parameters import API_KEY, SECRET_KEY
+import logging
+import threading
+import time
+from http_client import get_json, get_json_async
+from log import fields
+from parameters import API_KEY, SCREENER_CACHE_SECONDS, SECRET_KEY
 
-STOCKS_URL = "https://data.alpaca.markets/v1beta1/screener/stocks/movers?top=50"
-
-CRYPTO_URL = "https://data.alpaca.markets/v1beta1/screener/crypto/movers?top=50"
+# market is "stocks" or "crypto"
+SCREENER_URL = "https://data.alpaca.markets/v1beta1/screener/{market}/movers"
 
 HEADERS = {
-    "accept": "application/json",
     "APCA-API-KEY-ID": API_KEY,
     "APCA-API-SECRET-KEY": SECRET_KEY,
 }
 
-def get_top_stocks_gainers():
-    response = requests.get(STOCKS_URL, headers=HEADERS)
-    data = response.json()
+logger = logging.getLogger("movers")
 
-    gainers = data['gainers']
-    losers = data['losers']
+# (market, top) -> (monotonic expiry, (gainers, losers))
+_cache = {}
+_cache_lock = threading.Lock()
 
-    print("\nTop Gainers:")
-    print("-----------")
-    for gainer in gainers:
-        print(f"Symbol: {gainer['symbol']:<10} Change: {gainer['percent_change']:>.2f}%  Price: ${gainer['price']:.2f}")
 
-    # print("\nTop Losers:")
-    # print("----------")
-    # for loser in losers:
-    #     print(f"Symbol: {loser['symbol']:<10} Change: {loser['percent_change']:>6.2f}%  Price: ${loser['price']:.2f}")
+def _summary(movers):
+    return [(m["symbol"], m["percent_change"], m["price"]) for m in movers]
 
+
+def _parse(market, top, data):
+    if not isinstance(data, dict) or "gainers" not in data or "losers" not in data:
+        raise ValueError(f"unexpected {market} screener response: {str(data)[:200]}")
+    gainers, losers = data["gainers"], data["losers"]
+    logger.info(f"top {market} movers", extra=fields(top=top, gainers=_summary(gainers), losers=_summary(losers)))
     return gainers, losers
 
-def get_top_crypto_gainers():
-    response = requests.get(CRYPTO_URL, headers=HEADERS)
-    data = response.json()
 
-    gainers = data['gainers']
-    losers = data['losers']
+def _cached(key):
+    hit = _cache.get(key)
+    if hit is not None and hit[0] > time.monotonic():
+        return hit[1]
+    return None
+
+
+def _store(key, movers, ttl):
+    _cache[key] = (time.monotonic() + ttl, movers)
+    return movers
+
 
+def get_movers(market: str, top: int = 50, ttl: float = SCREENER_CACHE_SECONDS):
+    """(gainers, losers) from the screener, reused for `ttl` seconds per market and `top`"""
+    key = (market, top)
+    # Held across the fetch so concurrent callers share one request
+    with _cache_lock:
+        movers = _cached(key)
+        if movers is None:
+            data = get_json(SCREENER_URL.format(market=market), params={"top": top}, headers=HEADERS)
+            movers = _store(key, _parse(market, top, data), ttl)
+        return movers
+
+
+async def get_movers_async(market: str, top: int = 50, ttl: float = SCREENER_CACHE_SECONDS):
+    """get_movers() for callers on an event loop; the request runs on the HTTP pool"""
+    key = (market, top)
+    movers = _cached(key)
+    if movers is None:
+        data = await get_json_async(SCREENER_URL.format(market=market), params={"top": top}, headers=HEADERS)
+        movers = _store(key, _parse(market, top, data), ttl)
+    return movers
+
+
+def get_top_stocks_gainers():
+    return get_movers("stocks")
+
+def get_top_crypto_gainers():
+    return get_movers("crypto")
+
+def print_movers(gainers, losers):
     print("\nTop Gainers:")
     print("-----------")
     for gainer in gainers:
@@ -49,8 +83,6 @@ def get_top_crypto_gainers():
     for loser in losers:
         print(f"Symbol: {loser['symbol']:<10} Change: {loser['percent_change']:>6.2f}%  Price: ${loser['price']:.2f}")
 
-    return gainers, losers
-
 if __name__ == "__main__":
-    # get_top_crypto_gainers()
-    get_top_stocks_gainers()
\ No newline at end of file
+    # print_movers(*get_top_crypto_gainers())
+    print_movers(*get_top_stocks_gainers())
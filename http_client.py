@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache, partial
+import requests
+from requests.adapters import HTTPAdapter
+from log import fields
+import metrics
+from parameters import HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_RETRIES
+
+logger = logging.getLogger("http")
+
+# Worth another try: rate limited or a server-side failure
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+HTTP_RETRIES_TOTAL = metrics.registry.counter("http_retries_total", "REST requests retried after a failure")
+
+# Runs the blocking requests for callers on an event loop
+http_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="http")
+
+
+@cache
+def session() -> requests.Session:
+    """One keep-alive session for the process, so repeated calls reuse their TLS connections"""
+    s = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    s.headers["accept"] = "application/json"
+    return s
+
+
+def _retry_after(response) -> float:
+    try:
+        return float(response.headers.get("Retry-After", 0))
+    except ValueError:
+        # The HTTP-date form; the backoff will do
+        return 0.0
+
+
+def get_json(
+    url,
+    params=None,
+    headers=None,
+    timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT),
+    retries=HTTP_RETRIES,
+    backoff=0.5,
+    max_backoff=8.0,
+):
+    """
+    GET `url` and decode its JSON body. Connection errors, timeouts, 429s and
+    5xx responses are retried up to `retries` times with jittered
+    exponential backoff (at least as long as a Retry-After asks for); any
+    other error status raises requests.HTTPError straight away.
+    """
+    for attempt in range(retries + 1):
+        wait = 0.0
+        try:
+            response = session().get(url, params=params, headers=headers, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = e
+        else:
+            if response.status_code not in RETRY_STATUSES:
+                response.raise_for_status()
+                return response.json()
+            error = requests.HTTPError(f"{response.status_code} from {url}", response=response)
+            wait = _retry_after(response)
+        if attempt == retries:
+            raise error
+        delay = max(wait, min(max_backoff, backoff * 2**attempt) * random.uniform(0.5, 1.0))
+        HTTP_RETRIES_TOTAL.inc()
+        logger.warning(
+            "request failed, retrying", extra=fields(url=url, attempt=attempt + 1, delay=round(delay, 2), error=str(error))
+        )
+        time.sleep(delay)
+
+
+async def get_json_async(url, params=None, headers=None, **kwargs):
+    """get_json() on the HTTP pool, so retries and backoff never block the caller's loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(http_executor, partial(get_json, url, params, headers, **kwargs))
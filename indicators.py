@@ -0,0 +1,126 @@
+from collections import deque
+import math
+
+
+class SMA:
+    """Simple moving average kept as a running sum over the last `window` values"""
+
+    def __init__(self, window: int = 20):
+        self.window = window
+        self.value = math.nan
+        self._values = deque()
+        self._sum = 0.0
+        self._updates = 0
+
+    def update(self, value: float) -> float:
+        self._values.append(value)
+        self._sum += value
+        if len(self._values) > self.window:
+            self._sum -= self._values.popleft()
+
+        # Re-sum the window now and then so float error can't build up
+        self._updates += 1
+        if self._updates % (self.window * 64) == 0:
+            self._sum = math.fsum(self._values)
+
+        # Before the window is full this is the expanding mean, like `ta` with fillna=True
+        self.value = self._sum / len(self._values)
+        return self.value
+
+
+class RSI:
+    """Relative strength index with Wilder smoothing of gains and losses"""
+
+    def __init__(self, window: int = 14):
+        self.window = window
+        self.value = math.nan
+        self._alpha = 1 / window
+        self._prev_close = None
+        self._avg_gain = 0.0
+        self._avg_loss = 0.0
+
+    def update(self, close: float) -> float:
+        if self._prev_close is None:
+            # `ta` seeds both averages with a zero change on the first bar
+            gain = loss = 0.0
+        else:
+            diff = close - self._prev_close
+            gain = diff if diff > 0 else 0.0
+            loss = -diff if diff < 0 else 0.0
+        self._prev_close = close
+
+        self._avg_gain += self._alpha * (gain - self._avg_gain)
+        self._avg_loss += self._alpha * (loss - self._avg_loss)
+
+        if self._avg_loss == 0:
+            self.value = 100.0
+        else:
+            self.value = 100 - 100 / (1 + self._avg_gain / self._avg_loss)
+        return self.value
+
+
+class Indicators:
+    """SMA-20 and RSI-14 state for one symbol, updated one bar at a time"""
+
+    def __init__(self, sma_window: int = 20, rsi_window: int = 14):
+        self.sma = SMA(sma_window)
+        self.rsi = RSI(rsi_window)
+        self.count = 0
+        self.timestamp = None
+
+    def update(self, bar) -> bool:
+        """Feed a bar; bars at or before the last seen timestamp are ignored"""
+        if self.timestamp is not None and bar.timestamp <= self.timestamp:
+            return False
+        self.timestamp = bar.timestamp
+        self.sma.update(bar.close)
+        self.rsi.update(bar.close)
+        self.count += 1
+        return True
+
+
+def warm_up(indicators: dict, bars_by_symbol: dict):
+    """Seed per-symbol indicator state from a batched history response"""
+    for symbol, bars in bars_by_symbol.items():
+        state = indicators.setdefault(symbol, Indicators())
+        for bar in bars:
+            state.update(bar)
+
+
+if __name__ == "__main__":
+    import time
+    import numpy as np
+    import pandas as pd
+    import ta
+
+    rng = np.random.default_rng(7)
+    closes = 3 + np.cumsum(rng.normal(0, 0.02, 2000))
+
+    # Parity with `ta` (fillna=True) over the same history
+    sma_ta = ta.trend.sma_indicator(pd.Series(closes), window=20, fillna=True)
+    rsi_ta = ta.momentum.RSIIndicator(pd.Series(closes), window=14, fillna=True).rsi()
+    sma, rsi = SMA(20), RSI(14)
+    sma_diff = max(abs(sma.update(c) - s) for c, s in zip(closes, sma_ta))
+    rsi_diff = max(abs(rsi.update(c) - r) for c, r in zip(closes, rsi_ta))
+    print(f"Max SMA difference vs ta: {sma_diff:.3e}")
+    print(f"Max RSI difference vs ta: {rsi_diff:.3e}")
+    assert sma_diff < 1e-9 and rsi_diff < 1e-9
+
+    # Per-bar latency: old path recomputed `ta` over a 25 bar window every bar
+    rounds = 1000
+    window = pd.Series(closes[:25])
+    start = time.perf_counter()
+    for _ in range(rounds):
+        ta.trend.sma_indicator(window, window=20, fillna=True).iloc[-1]
+        ta.momentum.RSIIndicator(window, window=14, fillna=True).rsi().iloc[-1]
+    ta_us = (time.perf_counter() - start) / rounds * 1e6
+
+    sma, rsi = SMA(20), RSI(14)
+    start = time.perf_counter()
+    for c in closes.tolist() * (rounds // 100):
+        sma.update(c)
+        rsi.update(c)
+    incremental_us = (time.perf_counter() - start) / (len(closes) * (rounds // 100)) * 1e6
+
+    print(f"ta per bar:          {ta_us:8.2f} us")
+    print(f"incremental per bar: {incremental_us:8.2f} us ({ta_us / incremental_us:.0f}x faster)")
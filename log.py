@@ -0,0 +1,140 @@
+import atexit
+import json
+import logging
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from pathlib import Path
+from parameters import (
+    LOG_BACKUPS,
+    LOG_CONSOLE,
+    LOG_DECISION_SAMPLE,
+    LOG_DIR,
+    LOG_LEVEL,
+    LOG_LEVELS,
+    LOG_MAX_BYTES,
+)
+
+# Per-bar strategy decisions; DEBUG, so off unless LOG_LEVELS enables it
+decisions = logging.getLogger("decisions")
+
+
+def fields(**values):
+    """Structured fields for a record: logger.info("msg", extra=fields(symbol=...))"""
+    return {"fields": values}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class ConsoleFormatter(logging.Formatter):
+    """Readable one-liners for `docker logs`, fields appended as key=value"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s: %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        extra = getattr(record, "fields", None)
+        if extra:
+            line += " " + " ".join(f"{k}={v}" for k, v in extra.items())
+        return line
+
+
+class ConsoleHandler(logging.StreamHandler):
+    """Writes to whatever sys.stdout is at emit time"""
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Hands the record to the listener thread untouched. The stock
+    QueueHandler formats the message on the calling thread; here all
+    formatting and I/O happen on the listener.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class SymbolSampler:
+    """Keeps one in every `every` decisions per symbol"""
+
+    def __init__(self, every: int):
+        self.every = max(1, every)
+        self.seen = {}
+
+    def __call__(self, symbol: str) -> bool:
+        n = self.seen.get(symbol, 0)
+        self.seen[symbol] = n + 1
+        return n % self.every == 0
+
+
+_sampler = SymbolSampler(LOG_DECISION_SAMPLE)
+_listener = None
+
+
+def log_decision(symbol: str) -> bool:
+    """Whether to build a decision record for this bar; check before building it"""
+    return decisions.isEnabledFor(logging.DEBUG) and _sampler(symbol)
+
+
+def _parse_levels(spec: str) -> dict:
+    levels = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, level = item.partition("=")
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging(name: str, directory=LOG_DIR):
+    """
+    Route every logger through a queue to a background thread that writes
+    JSON lines to `directory/<name>.jsonl` (rotated by size) and, unless
+    LOG_CONSOLE=0, readable lines to stdout. Safe to call more than once.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    handlers = []
+    if directory:
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        file_handler = RotatingFileHandler(
+            Path(directory) / f"{name}.jsonl", maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS
+        )
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+    if LOG_CONSOLE:
+        console = ConsoleHandler()
+        console.setFormatter(ConsoleFormatter())
+        handlers.append(console)
+
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers[:] = [DeferredQueueHandler(records)]
+    root.setLevel(LOG_LEVEL)
+    for logger_name, level in _parse_levels(LOG_LEVELS).items():
+        logging.getLogger(logger_name).setLevel(level)
+
+    _listener = QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
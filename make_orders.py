@@ -1,58 +1,129 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache, partial
 from alpaca.trading.client import TradingClient
-from alpaca.trading.requests import MarketOrderRequest, StopLossRequest, TakeProfitRequest
-from alpaca.trading.enums import OrderSide, TimeInForce, OrderClass
+from alpaca.trading.requests import (
+    GetOrdersRequest,
+    LimitOrderRequest,
+    MarketOrderRequest,
+    StopLossRequest,
+    TakeProfitRequest,
+)
+from alpaca.trading.enums import TimeInForce, OrderClass, QueryOrderStatus
+from log import fields
 from parameters import API_KEY, SECRET_KEY
 
-trading_clinet = TradingClient(API_KEY, SECRET_KEY, paper=True)
+logger = logging.getLogger("orders")
+
+@cache
+def get_trading_client():
+    # Created on first use so importing this module needs no credentials or network
+    return TradingClient(API_KEY, SECRET_KEY, paper=True)
+
+# Bounded pool that runs the blocking REST calls off the stream's event loop
+order_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="orders")
 
 def get_account_balance():
-    return trading_clinet.get_account().cash
+    return get_trading_client().get_account().cash
 
 def get_orders():
-    return trading_clinet.get_orders()
+    return get_trading_client().get_orders()
 
 def get_open_positions(symbol: str):
-    return trading_clinet.get_open_position(symbol)
+    return get_trading_client().get_open_position(symbol)
 
 def get_positions():
-    return trading_clinet.get_all_positions()
+    return get_trading_client().get_all_positions()
 
-def make_market_order(symbol: str, qty: int, side, take_profit: float, stop_loss: float):
+def _order_request(symbol: str, qty: int, side, limit_price=None, **kwargs):
+    """A limit order when there is a limit price, a market order otherwise"""
+    if limit_price is not None:
+        return LimitOrderRequest(
+            symbol=symbol, qty=qty, side=side, time_in_force=TimeInForce.DAY, limit_price=limit_price, **kwargs
+        )
+    return MarketOrderRequest(symbol=symbol, qty=qty, side=side, time_in_force=TimeInForce.DAY, **kwargs)
+
+def make_entry_order(
+    symbol: str, qty: int, side, take_profit: float, stop_loss: float, limit_price=None, client_order_id=None
+):
     try:
-        bracket__order_data = MarketOrderRequest(
-                    symbol=symbol,
-                    qty=qty,
-                    side=side,
-                    time_in_force=TimeInForce.DAY,
-                    order_class=OrderClass.BRACKET,
-                    take_profit=TakeProfitRequest(limit_price=take_profit),
-                    stop_loss=StopLossRequest(stop_price=stop_loss)
-                    )
-
-        market_order = trading_clinet.submit_order(bracket__order_data)
-        print(f"Take Profit: {take_profit:.2f}\nStop Loss: {stop_loss:.2f}")
-        return market_order
-    except Exception as e:
-        print(f"Error processing trade: {str(e)}")
-
-def make_sell_order(symbol: str, qty: int, side):
+        order_data = _order_request(
+            symbol,
+            qty,
+            side,
+            limit_price,
+            client_order_id=client_order_id,
+            order_class=OrderClass.BRACKET,
+            take_profit=TakeProfitRequest(limit_price=take_profit),
+            stop_loss=StopLossRequest(stop_price=stop_loss),
+        )
+
+        order = get_trading_client().submit_order(order_data)
+        logger.info(
+            "bracket order submitted",
+            extra=fields(
+                symbol=symbol,
+                qty=qty,
+                limit_price=limit_price,
+                take_profit=take_profit,
+                stop_loss=stop_loss,
+                order_id=order.id,
+            ),
+        )
+        return order
+    except Exception:
+        logger.exception("error submitting order", extra=fields(symbol=symbol, qty=qty))
+
+def get_open_orders(symbol: str):
+    """Working orders of a symbol, including ones Alpaca is still canceling"""
+    return get_trading_client().get_orders(GetOrdersRequest(status=QueryOrderStatus.OPEN, symbols=[symbol]))
+
+def cancel_order(order_id):
+    # Only requests the cancel; Alpaca confirms it asynchronously
+    get_trading_client().cancel_order_by_id(order_id)
+
+def make_exit_order(symbol: str, qty: int, side, limit_price=None, client_order_id=None):
     try:
-        bracket__order_data = MarketOrderRequest(
-                    symbol=symbol,
-                    qty=qty,
-                    side=side,
-                    time_in_force=TimeInForce.DAY,
-                    order_class=OrderClass.BRACKET,
-                    )
-
-        market_order = trading_clinet.submit_order(bracket__order_data)
-        print(f"Placing sell order for {qty} shares of {symbol} as a {side} order.")
-        return market_order
-    except Exception as e:
-        print(f"Error processing trade: {str(e)}")
+        order_data = _order_request(symbol, qty, side, limit_price, client_order_id=client_order_id)
+
+        order = get_trading_client().submit_order(order_data)
+        logger.info(
+            "sell order submitted",
+            extra=fields(symbol=symbol, qty=qty, side=side, limit_price=limit_price, order_id=order.id),
+        )
+        return order
+    except Exception:
+        logger.exception("error submitting order", extra=fields(symbol=symbol, qty=qty))
 
 def close_all_positions():
-    return trading_clinet.close_all_positions(True)
+    return get_trading_client().close_all_positions(True)
+
+async def _run_in_executor(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(order_executor, partial(func, *args))
+
+async def get_open_positions_async(symbol: str):
+    return await _run_in_executor(get_open_positions, symbol)
+
+async def make_entry_order_async(
+    symbol: str, qty: int, side, take_profit: float, stop_loss: float, limit_price=None, client_order_id=None
+):
+    return await _run_in_executor(
+        make_entry_order, symbol, qty, side, take_profit, stop_loss, limit_price, client_order_id
+    )
+
+async def get_open_orders_async(symbol: str):
+    return await _run_in_executor(get_open_orders, symbol)
+
+async def cancel_order_async(order_id):
+    return await _run_in_executor(cancel_order, order_id)
+
+async def make_exit_order_async(symbol: str, qty: int, side, limit_price=None, client_order_id=None):
+    return await _run_in_executor(make_exit_order, symbol, qty, side, limit_price, client_order_id)
+
+async def close_all_positions_async():
+    return await _run_in_executor(close_all_positions)
 
 if __name__ == "__main__":
     print(get_account_balance())
@@ -0,0 +1,225 @@
+import logging
+import math
+from datetime import datetime, timedelta, timezone
+from functools import cached_property
+import numpy as np
+from alpaca.data import (
+    StockHistoricalDataClient,
+    CryptoHistoricalDataClient,
+    StockBarsRequest,
+    CryptoBarsRequest,
+    StockLatestQuoteRequest,
+    CryptoLatestQuoteRequest,
+)
+from alpaca.data.live import StockDataStream, CryptoDataStream
+from alpaca.data.timeframe import TimeFrame
+from alpaca.trading.requests import GetCalendarRequest
+import pytz
+import get_top_gainers
+from make_orders import get_trading_client
+from parameters import API_KEY, BRACKET_SIZING, BRACKET_STOP_ATR, BRACKET_TAKE_PROFIT_ATR, SECRET_KEY
+
+logger = logging.getLogger("markets")
+
+EASTERN = pytz.timezone("US/Eastern")
+
+
+def from_eastern(local: datetime) -> datetime:
+    """A naive Eastern wall-clock time as an aware UTC datetime"""
+    return EASTERN.localize(local).astimezone(timezone.utc)
+
+
+def eastern(day, hour: int, minute: int) -> datetime:
+    return from_eastern(datetime(day.year, day.month, day.day, hour, minute))
+
+
+def eastern_days(now: datetime, days=7):
+    today = now.astimezone(EASTERN).date()
+    return [today + timedelta(days=i) for i in range(days)]
+
+
+class Market:
+    """
+    Everything that differs between the stock and crypto bots: clients,
+    symbol filter, entry/exit rules and the trading sessions. The
+    clients are created on first use and shared by everything in the process.
+    """
+
+    name = None
+    lookback_minutes = None
+    stop_factor = None
+    stop_offset = None
+    sma_factor = 0.95
+    rsi_threshold = 30
+
+    def get_movers(self):
+        raise NotImplementedError
+
+    def get_bars(self, symbols, start, end=None):
+        """Minute bars for many symbols in one request, keyed by symbol"""
+        raise NotImplementedError
+
+    def latest_quote(self, symbol):
+        """(bid, ask) from the REST latest-quote endpoint"""
+        raise NotImplementedError
+
+    def accepts(self, bar) -> bool:
+        return True
+
+    def entry_signal(self, bar, sma, rsi) -> bool:
+        return bar.close < sma * self.sma_factor or rsi < self.rsi_threshold
+
+    def entry_signals(self, close, vwap, sma, rsi):
+        """entry_signal() for a whole cross-section of bars at once, as NumPy arrays"""
+        return (close < sma * self.sma_factor) | (rsi < self.rsi_threshold)
+
+    def entry_scores(self, close, sma, rsi):
+        """
+        How deep each entry signal is, for ranking: the larger of the
+        distance below the SMA threshold, as a share of the SMA's band, and
+        the RSI depth below its threshold, as a share of the threshold.
+        Positive exactly when one of the entry conditions holds.
+        """
+        band = sma * (1 - self.sma_factor)
+        below_sma = (sma * self.sma_factor - close) / band
+        below_rsi = (self.rsi_threshold - rsi) / self.rsi_threshold
+        return np.maximum(below_sma, below_rsi)
+
+    def exit_signal(self, bar, sma, entry_price) -> bool:
+        return False
+
+    def sessions(self, now):
+        """(entries open, flatten) of the sessions from today on, as UTC datetimes"""
+        raise NotImplementedError
+
+    def describe_decision(self, bar, sma, rsi):
+        """Fields of a decision record; only called when decision logging is on"""
+        return {
+            "symbol": bar.symbol,
+            "close": bar.close,
+            "sma_threshold": sma * self.sma_factor,
+            "rsi": rsi,
+            "entry": bool(self.entry_signal(bar, sma, rsi)),
+        }
+
+    def bracket(self, price, atr=math.nan):
+        """
+        Stop loss and take profit around an entry price, at least a cent away.
+        Sized from the average true range when there is one and BRACKET_SIZING is
+        "atr", otherwise fixed percentages.
+        """
+        if BRACKET_SIZING == "atr" and atr > 0:
+            stop_loss = round(max(min(price - BRACKET_STOP_ATR * atr, price - self.stop_offset), 0.01), 2)
+            take_profit = round(max(price + BRACKET_TAKE_PROFIT_ATR * atr, price + 0.01), 2)
+            return stop_loss, take_profit
+        stop_loss = round(min(price * self.stop_factor, price - self.stop_offset), 2)
+        take_profit = round(max(price * 1.02, price + 0.01), 2)
+        return stop_loss, take_profit
+
+    def history_start(self):
+        return datetime.now(timezone.utc) - timedelta(minutes=self.lookback_minutes)
+
+
+class StockMarket(Market):
+    name = "stock"
+    lookback_minutes = 25
+    stop_factor = 0.98
+    stop_offset = 0.02
+
+    @cached_property
+    def stream(self):
+        return StockDataStream(API_KEY, SECRET_KEY)
+
+    @cached_property
+    def data_client(self):
+        return StockHistoricalDataClient(API_KEY, SECRET_KEY)
+
+    def get_movers(self):
+        return get_top_gainers.get_top_stocks_gainers()
+
+    def get_bars(self, symbols, start, end=None):
+        request_params = StockBarsRequest(
+            symbol_or_symbols=symbols,
+            start=start,
+            end=end,
+            timeframe=TimeFrame.Minute,
+        )
+        return self.data_client.get_stock_bars(request_params).data
+
+    def latest_quote(self, symbol):
+        quote = self.data_client.get_stock_latest_quote(StockLatestQuoteRequest(symbol_or_symbols=symbol))[symbol]
+        return quote.bid_price, quote.ask_price
+
+    def accepts(self, bar):
+        # Filter out stocks that are above $5 or below $1
+        return 1.0 <= bar.close <= 5.0
+
+    def exit_signal(self, bar, sma, entry_price):
+        # Sell only if current price is above purchase price and meets other conditions
+        return bar.close > entry_price and (
+            bar.close > sma * 1.02 or bar.close <= bar.vwap * 0.95
+        )
+
+    def sessions(self, now):
+        # Close everything an hour before the bell: 3:00 PM Eastern on a regular day
+        days = eastern_days(now)
+        try:
+            calendar = get_trading_client().get_calendar(GetCalendarRequest(start=days[0], end=days[-1]))
+        except Exception:
+            logger.warning("market calendar unavailable, assuming regular weekday hours", exc_info=True)
+            return [(eastern(day, 9, 30), eastern(day, 15, 0)) for day in days if day.weekday() < 5]
+        # Open and close are Eastern wall-clock times, early closes included
+        return [(from_eastern(day.open), from_eastern(day.close - timedelta(hours=1))) for day in calendar]
+
+
+class CryptoMarket(Market):
+    name = "crypto"
+    lookback_minutes = 60
+    stop_factor = 0.95
+    stop_offset = 0.01
+
+    @cached_property
+    def stream(self):
+        return CryptoDataStream(API_KEY, SECRET_KEY)
+
+    @cached_property
+    def data_client(self):
+        return CryptoHistoricalDataClient(API_KEY, SECRET_KEY)
+
+    def get_movers(self):
+        return get_top_gainers.get_top_crypto_gainers()
+
+    def get_bars(self, symbols, start, end=None):
+        request_params = CryptoBarsRequest(
+            symbol_or_symbols=symbols,
+            start=start,
+            end=end,
+            timeframe=TimeFrame.Minute,
+        )
+        return self.data_client.get_crypto_bars(request_params).data
+
+    def latest_quote(self, symbol):
+        quote = self.data_client.get_crypto_latest_quote(CryptoLatestQuoteRequest(symbol_or_symbols=symbol))[symbol]
+        return quote.bid_price, quote.ask_price
+
+    def accepts(self, bar):
+        return bar.symbol.endswith("/USD")
+
+    def entry_signal(self, bar, sma, rsi):
+        return super().entry_signal(bar, sma, rsi) and bar.close >= bar.vwap
+
+    def entry_signals(self, close, vwap, sma, rsi):
+        return super().entry_signals(close, vwap, sma, rsi) & (close >= vwap)
+
+    def sessions(self, now):
+        # Trades around the clock, closing everything at 3:00 PM Eastern each day
+        return [(eastern(day - timedelta(days=1), 15, 0), eastern(day, 15, 0)) for day in eastern_days(now)]
+
+    def describe_decision(self, bar, sma, rsi):
+        return {**super().describe_decision(bar, sma, rsi), "vwap": bar.vwap}
+
+
+MARKETS = {
+    "stock": StockMarket(),
+    "crypto": CryptoMarket(),
+}
@@ -0,0 +1,165 @@
+import logging
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from log import fields
+from parameters import METRICS_PORT
+
+logger = logging.getLogger("metrics")
+
+# Upper bounds in seconds, from sub-millisecond handler stages up to a slow REST call
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Lag of a decision behind the close of its bar, up to a couple of bars late
+LAG_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, **labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        yield self.name, self.labels, self.value
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram. observe() is a bisect and two additions, cheap
+    enough to call several times per bar on the event loop.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS, **labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f"{self.name}_bucket", {**self.labels, "le": bound}, cumulative
+        cumulative += self.counts[-1]
+        yield f"{self.name}_bucket", {**self.labels, "le": "+Inf"}, cumulative
+        yield f"{self.name}_sum", self.labels, self.sum
+        yield f"{self.name}_count", self.labels, cumulative
+
+
+class Gauge:
+    """Value read from a callback when the metrics are scraped"""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, read, **labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.read = read
+
+    def samples(self):
+        yield self.name, self.labels, self.read()
+
+
+class Registry:
+    def __init__(self):
+        # name -> metrics sharing it (one per label set), kept together when rendered
+        self.families = {}
+
+    def _add(self, metric):
+        self.families.setdefault(metric.name, []).append(metric)
+        return metric
+
+    def counter(self, name, help, **labels):
+        return self._add(Counter(name, help, **labels))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS, **labels):
+        return self._add(Histogram(name, help, buckets, **labels))
+
+    def gauge(self, name, help, read, **labels):
+        return self._add(Gauge(name, help, read, **labels))
+
+    def render(self) -> str:
+        """Prometheus text exposition format"""
+        lines = []
+        for family in self.families.values():
+            lines.append(f"# HELP {family[0].name} {family[0].help}")
+            lines.append(f"# TYPE {family[0].name} {family[0].kind}")
+            for metric in family:
+                for name, labels, value in metric.samples():
+                    lines.append(f"{name}{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+bars_received = registry.counter("bars_received_total", "Bars delivered by the stream")
+bars_filtered = registry.counter("bars_filtered_total", "Bars skipped by the market's price/symbol filter")
+ticks_received = registry.counter("ticks_received_total", "Trades and quotes delivered by the stream")
+orders_sent = registry.counter("orders_sent_total", "Orders submitted to Alpaca")
+decision_lag = registry.histogram(
+    "bar_decision_lag_seconds",
+    "Seconds from the close of a bar (a minute, or a second in microstructure mode) to the trading decision",
+    LAG_BUCKETS,
+)
+
+
+def stage_histogram(stage):
+    return registry.histogram("stage_seconds", "Wall time of each bot stage", stage=stage)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+
+
+def start_server(port=METRICS_PORT):
+    """
+    Serve /metrics from a daemon thread, off the stream's event loop; port 0
+    disables it. A port that can't be bound is logged and the bot trades on
+    without metrics.
+    """
+    global _server
+    if port and _server is None:
+        try:
+            _server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+        except OSError:
+            logger.exception("metrics server not started", extra=fields(port=port))
+            return None
+        threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+    return _server
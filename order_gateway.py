@@ -0,0 +1,226 @@
+import asyncio
+import itertools
+import logging
+import time
+from log import fields
+import metrics
+from make_orders import (
+    cancel_order_async,
+    close_all_positions_async,
+    get_open_orders_async,
+    make_entry_order_async,
+    make_exit_order_async,
+)
+from positions import position_book
+
+logger = logging.getLogger("orders")
+
+# Stay under Alpaca's 200 requests/minute, leaving room for reconciles and account calls
+ORDER_RATE_PER_MINUTE = 150
+ORDER_BURST = 10
+
+# Lower runs first when the budget is tight
+FLATTEN, EXIT, ENTRY = 0, 1, 2
+
+STAGE_QUEUE = metrics.stage_histogram("order_queue")
+STAGE_SUBMIT = metrics.stage_histogram("order_submit")
+ORDERS_REJECTED = metrics.registry.counter("orders_rejected_total", "Repeat orders rejected by the duplicate guard")
+FLATTENS = metrics.registry.counter("flattens_total", "Close-all-positions calls sent for the session flatten")
+ORDERS_THROTTLED = metrics.registry.counter("orders_throttled_total", "Entries dropped after waiting too long for the rate limit")
+
+
+class TokenBucket:
+    def __init__(self, rate_per_second: float, capacity: int):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def take(self):
+        self._refill()
+        while self.tokens < 1:
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+            self._refill()
+        self.tokens -= 1
+
+
+class OrderGateway:
+    """
+    Single path for orders leaving the process.
+
+    Entries for a symbol that already has a position, a working order or an
+    entry queued/just submitted are rejected, and so are exits while an
+    order for the symbol is queued or within its grace period. Everything
+    else goes through a priority queue drained under a token-bucket rate
+    limit, so exits and the
+    end-of-day flatten go before new entries, and entries that waited too
+    long are dropped as throttled.
+    """
+
+    def __init__(
+        self,
+        rate_per_minute=ORDER_RATE_PER_MINUTE,
+        burst=ORDER_BURST,
+        workers=8,
+        max_entry_wait=30.0,
+        in_flight_grace=10.0,
+    ):
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.workers = workers
+        self.max_entry_wait = max_entry_wait
+        self.in_flight_grace = in_flight_grace
+        # symbol -> monotonic submit time (inf while still queued)
+        self.in_flight = {}
+        self.submitted = 0
+        self.flattened = 0
+        self.rejected = 0
+        self.throttled = 0
+        self.errors = 0
+        self._seq = itertools.count()
+        self._loop = None
+
+    def _ensure_workers(self):
+        # Bound to the running loop; rebuilt if the stream starts a new one
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Orders queued on the old loop died with its workers; their markers would never clear
+            self.in_flight = {s: t for s, t in self.in_flight.items() if t != float("inf")}
+            self._loop = loop
+            self._queue = asyncio.PriorityQueue()
+            self._bucket = TokenBucket(self.rate_per_minute / 60, self.burst)
+            self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    def stats(self):
+        return {
+            "queue_depth": self._queue.qsize() if self._loop else 0,
+            "in_flight": len(self.in_flight),
+            "submitted": self.submitted,
+            "flattened": self.flattened,
+            "rejected": self.rejected,
+            "throttled": self.throttled,
+            "errors": self.errors,
+        }
+
+    def _recent(self, symbol: str) -> bool:
+        """An order for `symbol` is queued or went out less than `in_flight_grace` seconds ago"""
+        submitted_at = self.in_flight.get(symbol)
+        if submitted_at is not None and time.monotonic() - submitted_at < self.in_flight_grace:
+            return True
+        self.in_flight.pop(symbol, None)
+        return False
+
+    def _busy(self, symbol: str) -> bool:
+        if self._recent(symbol):
+            return True
+        return position_book.position(symbol)[0] or bool(position_book.open_orders(symbol))
+
+    async def _enqueue(self, priority, symbol, call, *args):
+        self._ensure_workers()
+        future = self._loop.create_future()
+        await self._queue.put((priority, next(self._seq), time.monotonic(), symbol, call, args, future))
+        return await future
+
+    async def submit_entry(
+        self, symbol: str, qty: int, side, take_profit: float, stop_loss: float, limit_price=None, client_order_id=None
+    ):
+        if self._busy(symbol):
+            self.rejected += 1
+            ORDERS_REJECTED.inc()
+            return None
+        self.in_flight[symbol] = float("inf")
+        return await self._enqueue(
+            ENTRY, symbol, make_entry_order_async, symbol, qty, side, take_profit, stop_loss, limit_price, client_order_id
+        )
+
+    async def submit_exit(self, symbol: str, qty: int, side, limit_price=None, client_order_id=None):
+        # A working exit is left alone for the grace period instead of being replaced every bar
+        if self._recent(symbol):
+            self.rejected += 1
+            ORDERS_REJECTED.inc()
+            return None
+        self.in_flight[symbol] = float("inf")
+        return await self._enqueue(EXIT, symbol, self._exit, symbol, qty, side, limit_price, client_order_id)
+
+    async def _exit(self, symbol, qty, side, limit_price, client_order_id, timeout=5.0, poll=0.25):
+        """
+        Cancel the symbol's working orders (the legs of its bracket hold the
+        shares), wait until Alpaca has processed the cancels, then sell.
+        Every REST call takes a token; the worker paid for the first.
+        """
+        try:
+            orders = await get_open_orders_async(symbol)
+            for order in orders:
+                await self._bucket.take()
+                await cancel_order_async(order.id)
+            deadline = time.monotonic() + timeout
+            while orders:
+                if time.monotonic() > deadline:
+                    logger.warning("orders still open after canceling", extra=fields(symbol=symbol, orders=len(orders)))
+                    return None
+                await asyncio.sleep(poll)
+                await self._bucket.take()
+                orders = await get_open_orders_async(symbol)
+        except Exception:
+            logger.exception("error canceling orders", extra=fields(symbol=symbol))
+            return None
+        has_position, held = position_book.position(symbol)
+        if not has_position:
+            # A leg filled while the others were being canceled
+            logger.info("position closed before exit", extra=fields(symbol=symbol))
+            return None
+        await self._bucket.take()
+        return await make_exit_order_async(symbol, min(qty, int(held)), side, limit_price, client_order_id)
+
+    async def flatten(self):
+        return await self._enqueue(FLATTEN, None, close_all_positions_async)
+
+    async def _worker(self):
+        while True:
+            priority, _, queued_at, symbol, call, args, future = await self._queue.get()
+            try:
+                if priority == ENTRY and time.monotonic() - queued_at > self.max_entry_wait:
+                    # The signal is stale by the time the budget allows it
+                    self.throttled += 1
+                    ORDERS_THROTTLED.inc()
+                    self.in_flight.pop(symbol, None)
+                    future.set_result(None)
+                    continue
+                await self._bucket.take()
+                started = time.monotonic()
+                STAGE_QUEUE.observe(started - queued_at)
+                result = await call(*args)
+                STAGE_SUBMIT.observe(time.monotonic() - started)
+                if symbol is None:
+                    self.flattened += 1
+                    FLATTENS.inc()
+                elif result is None:
+                    # Nothing went out: make_orders failed or the exit was abandoned
+                    self.errors += 1
+                    self.in_flight.pop(symbol, None)
+                else:
+                    self.submitted += 1
+                    metrics.orders_sent.inc()
+                    self.in_flight[symbol] = time.monotonic()
+                future.set_result(result)
+            except Exception as e:
+                self.errors += 1
+                self.in_flight.pop(symbol, None)
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                if self.in_flight.get(symbol) == float("inf"):
+                    # Cancelled with the loop before the order was settled
+                    self.in_flight.pop(symbol, None)
+                self._queue.task_done()
+
+
+order_gateway = OrderGateway()
+
+metrics.registry.gauge("order_queue_depth", "Orders waiting for the rate limiter", lambda: order_gateway.stats()["queue_depth"])
+metrics.registry.gauge("orders_in_flight", "Symbols with an entry or exit queued or just submitted", lambda: len(order_gateway.in_flight))
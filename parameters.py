@@ -5,4 +5,81 @@ from dotenv import load_dotenv
 load_dotenv()
 
 API_KEY = os.getenv("ALPACA_API_KEY")
-SECRET_KEY = os.getenv("ALPACA_SECRET_KEY")
\ No newline at end of file
+SECRET_KEY = os.getenv("ALPACA_SECRET_KEY")
+
+# How often the movers screener is re-queried to refresh the traded universe
+UNIVERSE_REFRESH_SECONDS = int(os.getenv("UNIVERSE_REFRESH_SECONDS", "300"))
+
+# Where fetched minute bars are cached between runs
+BAR_CACHE_DIR = os.getenv("BAR_CACHE_DIR", "data/bars")
+
+# Port of the local Prometheus-style /metrics endpoint (0 disables it)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+# Structured logging: JSON lines under LOG_DIR, rotated at LOG_MAX_BYTES
+LOG_DIR = os.getenv("LOG_DIR", "logs")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Per-logger overrides, e.g. "decisions=DEBUG,orders=WARNING"
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(20 * 1024 * 1024)))
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", "5"))
+LOG_CONSOLE = os.getenv("LOG_CONSOLE", "1") != "0"
+# Log one in every N decisions per symbol when decision logging is on
+LOG_DECISION_SAMPLE = int(os.getenv("LOG_DECISION_SAMPLE", "1"))
+
+# Worker processes the symbol universe is sharded across (1 = everything on the stream's loop).
+# Workers keep the indicators and decide on each bar; risk and orders stay in the main process.
+WORKERS = int(os.getenv("WORKERS", "1"))
+
+# Portfolio risk limits, as fractions of account equity unless noted
+RISK_ALLOCATION = float(os.getenv("RISK_ALLOCATION", "0.10"))
+RISK_MAX_POSITIONS = int(os.getenv("RISK_MAX_POSITIONS", "10"))
+RISK_MAX_SYMBOL_EXPOSURE = float(os.getenv("RISK_MAX_SYMBOL_EXPOSURE", "0.15"))
+RISK_MAX_GROSS_EXPOSURE = float(os.getenv("RISK_MAX_GROSS_EXPOSURE", "1.0"))
+RISK_DAILY_LOSS_LIMIT = float(os.getenv("RISK_DAILY_LOSS_LIMIT", "0.03"))
+# Seconds between account reconciles against the REST snapshot
+RISK_RECONCILE_SECONDS = int(os.getenv("RISK_RECONCILE_SECONDS", "60"))
+
+# How often live bars are persisted, gaps backfilled and the restart checkpoint written
+CHECKPOINT_SECONDS = int(os.getenv("CHECKPOINT_SECONDS", "60"))
+# A checkpoint older than this is ignored and the bot starts cold
+CHECKPOINT_MAX_AGE = int(os.getenv("CHECKPOINT_MAX_AGE", "900"))
+
+# Where the SQLite state (entry prices, working orders, indicator checkpoints) lives
+STATE_DIR = os.getenv("STATE_DIR", "data")
+
+# Session schedule: no new entries this many minutes before the flatten, exit this many after it
+ENTRY_CUTOFF_MINUTES = int(os.getenv("ENTRY_CUTOFF_MINUTES", "15"))
+SHUTDOWN_DELAY_MINUTES = int(os.getenv("SHUTDOWN_DELAY_MINUTES", "1"))
+
+# Microstructure mode: trades and quotes aggregated into second bars for sub-minute decisions
+MICROSTRUCTURE = os.getenv("MICROSTRUCTURE", "0") != "0"
+# Second bars kept per symbol
+TICK_WINDOW_SECONDS = int(os.getenv("TICK_WINDOW_SECONDS", "300"))
+# Entries are skipped while the quoted spread is wider than this, in basis points of the mid
+MAX_SPREAD_BPS = float(os.getenv("MAX_SPREAD_BPS", "50"))
+
+# Entry orders: "market", "limit" (resting at the quote mid) or "marketable" (a limit through the far side)
+ENTRY_ORDER_TYPE = os.getenv("ENTRY_ORDER_TYPE", "marketable")
+# How far a marketable limit reaches past the quote, in basis points
+MARKETABLE_OFFSET_BPS = float(os.getenv("MARKETABLE_OFFSET_BPS", "10"))
+# Bracket legs in multiples of the average true range of recent minute bars ("atr"),
+# or fixed percentages of the entry price ("percent")
+BRACKET_SIZING = os.getenv("BRACKET_SIZING", "atr")
+ATR_WINDOW = int(os.getenv("ATR_WINDOW", "14"))
+BRACKET_STOP_ATR = float(os.getenv("BRACKET_STOP_ATR", "2.0"))
+BRACKET_TAKE_PROFIT_ATR = float(os.getenv("BRACKET_TAKE_PROFIT_ATR", "2.0"))
+
+# Batch mode: decide on each minute's bars together, entering the best-ranked signals first
+BATCH_SCAN = os.getenv("BATCH_SCAN", "0") != "0"
+# Entries submitted per minute at most
+BATCH_TOP_K = int(os.getenv("BATCH_TOP_K", "5"))
+# Seconds to wait for the rest of a minute's bars after its first one arrives
+BATCH_WAIT_SECONDS = float(os.getenv("BATCH_WAIT_SECONDS", "2"))
+
+# REST calls outside alpaca-py (the screener): seconds to connect and to read, and retries after that
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.05"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "10"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "3"))
+# Screener movers are reused for this long before being fetched again
+SCREENER_CACHE_SECONDS = float(os.getenv("SCREENER_CACHE_SECONDS", "30"))
@@ -0,0 +1,148 @@
+import logging
+import threading
+from alpaca.trading.enums import OrderSide, TradeEvent
+from alpaca.trading.stream import TradingStream
+from log import fields
+from make_orders import get_orders, get_positions
+from parameters import API_KEY, SECRET_KEY
+
+logger = logging.getLogger("positions")
+
+# Events after which an order is no longer working
+CLOSED_EVENTS = {
+    TradeEvent.FILL,
+    TradeEvent.CANCELED,
+    TradeEvent.EXPIRED,
+    TradeEvent.REJECTED,
+    TradeEvent.REPLACED,
+}
+
+
+def _key(symbol: str) -> str:
+    # Positions report crypto as "BTCUSD" while orders and bars use "BTC/USD"
+    return symbol.replace("/", "")
+
+
+class PositionBook:
+    """
+    Positions, entry prices and working orders kept current from trade_updates.
+
+    Trade updates and reconciles arrive on other threads, but the book is
+    read while decisions iterate it. Once `dispatch` is set (the engine
+    points it at its stream runner) every change, listeners included, is
+    applied on the stream's loop, between bars.
+    """
+
+    def __init__(self):
+        self.dispatch = None
+        self.positions = {}
+        self.entry_prices = {}
+        self.orders = {}
+        # Called with every trade update after the book has applied it
+        self.listeners = []
+        # Called with the book after every REST reconcile
+        self.reconcile_listeners = []
+
+    def run(self, callback, *args):
+        """Run a change to the book (or to state kept in step with it) where the book is read"""
+        if self.dispatch is None:
+            return callback(*args)
+        return self.dispatch(callback, *args)
+
+    def reconcile(self, positions, orders):
+        """Replace the local state with a REST snapshot"""
+        self.run(self._reconcile, positions, orders)
+
+    def _reconcile(self, positions, orders):
+        self.positions = {_key(p.symbol): float(p.qty) for p in positions}
+        self.entry_prices = {
+            _key(p.symbol): float(p.avg_entry_price) for p in positions
+        }
+        self.orders = {order.id: order for order in orders}
+        logger.info("reconciled", extra=fields(positions=len(self.positions), open_orders=len(self.orders)))
+        for listener in self.reconcile_listeners:
+            listener(self)
+
+    def position(self, symbol: str):
+        """Return (has_position, qty) for a symbol"""
+        qty = self.positions.get(_key(symbol), 0.0)
+        return qty > 0, qty
+
+    def entry_price(self, symbol: str):
+        return self.entry_prices.get(_key(symbol))
+
+    def open_orders(self, symbol: str):
+        key = _key(symbol)
+        return [o for o in self.orders.values() if _key(o.symbol) == key]
+
+    async def on_trade_update(self, data):
+        self.run(self.apply, data)
+
+    def apply(self, data):
+        order = data.order
+        key = _key(order.symbol)
+
+        if data.event in (TradeEvent.FILL, TradeEvent.PARTIAL_FILL):
+            # position_qty is the account's position after this execution
+            position_qty = float(data.position_qty or 0)
+            fill_qty = float(data.qty or 0)
+            if position_qty <= 0:
+                self.positions.pop(key, None)
+                self.entry_prices.pop(key, None)
+            else:
+                if order.side == OrderSide.BUY and data.price is not None:
+                    prev_qty = position_qty - fill_qty
+                    prev_price = self.entry_prices.get(key, data.price)
+                    self.entry_prices[key] = (
+                        prev_qty * prev_price + fill_qty * float(data.price)
+                    ) / position_qty
+                self.positions[key] = position_qty
+
+        if data.event in CLOSED_EVENTS:
+            self.orders.pop(order.id, None)
+        else:
+            self.orders[order.id] = order
+
+        for listener in self.listeners:
+            listener(data)
+
+
+class PositionStream(TradingStream):
+    """TradingStream that reconciles the book again after every reconnect, and on connect until one succeeds"""
+
+    def __init__(self, book: PositionBook, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._book = book
+        self._connections = 0
+        self.reconciled = False
+
+    async def _start_ws(self):
+        await super()._start_ws()
+        self._connections += 1
+        if self._connections > 1 or not self.reconciled:
+            try:
+                self._book.reconcile(get_positions(), get_orders())
+                self.reconciled = True
+            except Exception:
+                logger.exception("reconcile failed, keeping the current book")
+
+
+position_book = PositionBook()
+
+
+def start_trade_updates():
+    """
+    Reconcile once, then keep the book current from a background
+    trade_updates stream. If that first reconcile fails, the book keeps what
+    it holds (restored from disk at startup) and the stream reconciles it
+    once it connects.
+    """
+    stream = PositionStream(position_book, API_KEY, SECRET_KEY, paper=True)
+    try:
+        position_book.reconcile(get_positions(), get_orders())
+        stream.reconciled = True
+    except Exception:
+        logger.exception("reconcile failed, trading from the restored book")
+    stream.subscribe_trade_updates(position_book.on_trade_update)
+    threading.Thread(target=stream.run, name="trade-updates", daemon=True).start()
+    return stream
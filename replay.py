@@ -0,0 +1,461 @@
+import argparse
+import asyncio
+import contextlib
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from uuid import uuid4
+import numpy as np
+import alpaca.data
+import alpaca.data.live
+import alpaca.trading.client
+import alpaca.trading.stream
+import requests
+
+# Bars fed to the indicators through the fake history endpoint before replay starts
+WARMUP_MINUTES = {"stock": 25, "crypto": 60}
+
+
+class ReplayFinished(BaseException):
+    """Raised by the fake stream once the bars run out so the engine returns to the harness"""
+
+
+class ReplayBar:
+    __slots__ = ("symbol", "timestamp", "open", "high", "low", "close", "volume", "vwap", "dispatched_at")
+
+    def __init__(self, symbol, timestamp, open, high, low, close, volume, vwap):
+        self.symbol = symbol
+        self.timestamp = timestamp
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+        self.vwap = vwap
+        self.dispatched_at = None
+
+
+def synthetic_bars(market: str, n_symbols: int, minutes: int, seed: int = 0) -> dict:
+    """Random-walk minute bars starting at the 09:30 ET open, priced inside the stock filter"""
+    rng = np.random.default_rng(seed)
+    start = datetime(2026, 6, 1, 13, 30, tzinfo=timezone.utc)
+    closes = 3 * np.exp(np.cumsum(rng.normal(0, 0.004, (minutes, n_symbols)), axis=0))
+    spread = np.abs(rng.normal(0, 0.002, (minutes, n_symbols)))
+    suffix = "/USD" if market == "crypto" else ""
+
+    bars = {}
+    for j in range(n_symbols):
+        symbol = f"S{j:04d}{suffix}"
+        bars[symbol] = [
+            ReplayBar(
+                symbol,
+                start + timedelta(minutes=i),
+                closes[i, j],
+                closes[i, j] * (1 + spread[i, j]),
+                closes[i, j] * (1 - spread[i, j]),
+                closes[i, j],
+                1000.0,
+                closes[i, j] * (1 - spread[i, j] / 2),
+            )
+            for i in range(minutes)
+        ]
+    return bars
+
+
+def synthetic_ticks(minute_bars, per_minute: int, spread_bps=10.0, seed: int = 0):
+    """A quote and a trade `per_minute` times a minute for each bar, priced inside its range"""
+    rng = np.random.default_rng(seed)
+    ticks = []
+    for bars in minute_bars:
+        u = rng.random((per_minute, len(bars)))
+        minute = []
+        for k in range(per_minute):
+            offset = timedelta(seconds=(k + 0.5) * 60 / per_minute)
+            for j, bar in enumerate(bars):
+                price = bar.low + (bar.high - bar.low) * u[k, j]
+                half = price * spread_bps / 20_000
+                timestamp = bar.timestamp + offset
+                minute.append(("quote", SimpleNamespace(symbol=bar.symbol, timestamp=timestamp, bid_price=price - half, ask_price=price + half)))
+                minute.append(("trade", SimpleNamespace(symbol=bar.symbol, timestamp=timestamp, price=price, size=100.0)))
+        ticks.append(minute)
+    return ticks
+
+
+def recorded_bars(path) -> dict:
+    """Load bars recorded in the backtest's Parquet/CSV layout"""
+    from backtest import load_bars
+
+    df = load_bars(path).sort_values(["symbol", "timestamp"])
+    bars = {}
+    for row in df.itertuples(index=False):
+        bars.setdefault(row.symbol, []).append(
+            ReplayBar(
+                row.symbol,
+                row.timestamp.to_pydatetime(),
+                row.open,
+                row.high,
+                row.low,
+                row.close,
+                row.volume,
+                row.vwap,
+            )
+        )
+    return bars
+
+
+class FakeHistoricalClient:
+    """Stand-in for Stock/CryptoHistoricalDataClient serving the warm-up bars"""
+
+    history = {}
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def get_stock_bars(self, request):
+        symbols = request.symbol_or_symbols
+        symbols = [symbols] if isinstance(symbols, str) else symbols
+        # The request model stores naive UTC datetimes
+        start = request.start.replace(tzinfo=timezone.utc)
+        end = request.end and request.end.replace(tzinfo=timezone.utc)
+        return SimpleNamespace(
+            data={
+                s: [b for b in self.history[s] if b.timestamp >= start and (end is None or b.timestamp <= end)]
+                for s in symbols
+                if s in self.history
+            }
+        )
+
+    get_crypto_bars = get_stock_bars
+
+    def get_stock_latest_quote(self, request):
+        # A 10 bps quote around the last close the fake stream replayed
+        time.sleep(FakeTradingClient.latency)
+        close = FakeDataStream.last_close[request.symbol_or_symbols]
+        return {request.symbol_or_symbols: SimpleNamespace(bid_price=close * 0.9995, ask_price=close * 1.0005)}
+
+    get_crypto_latest_quote = get_stock_latest_quote
+
+
+class FakeTradingClient:
+    """Stand-in for TradingClient; each call sleeps for a simulated REST round-trip"""
+
+    latency = 0.03
+    order_times = []
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def get_account(self):
+        return SimpleNamespace(cash="100000", equity="100000", last_equity="100000")
+
+    def submit_order(self, order_data):
+        time.sleep(self.latency)
+        FakeTradingClient.order_times.append(time.perf_counter())
+        return SimpleNamespace(id=uuid4(), symbol=order_data.symbol, qty=order_data.qty, side=order_data.side)
+
+    def get_orders(self, *args, **kwargs):
+        return []
+
+    def cancel_order_by_id(self, order_id):
+        time.sleep(self.latency)
+
+    def get_all_positions(self):
+        return []
+
+    def get_open_position(self, symbol):
+        time.sleep(self.latency)
+        raise Exception("position does not exist")
+
+    def close_all_positions(self, cancel_orders=None):
+        time.sleep(self.latency)
+        return []
+
+
+class FakeTradingStream:
+    """Stand-in for TradingStream; no trade updates are produced"""
+
+    def __init__(self, *args, **kwargs):
+        self._trade_updates_handler = None
+
+    def subscribe_trade_updates(self, handler):
+        self._trade_updates_handler = handler
+
+    def run(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class FakeDataStream:
+    """Stand-in for Stock/CryptoDataStream that replays bars into the subscribed handlers"""
+
+    bars = []
+    # Per minute, ("trade" | "quote", tick) in the order they happened inside it
+    ticks = []
+    speed = 0.0
+    loop_lag = []
+    # symbol -> close of the last bar replayed, for the fake latest quote
+    last_close = {}
+
+    def __init__(self, *args, **kwargs):
+        self._handlers = {}
+        self._tick_handlers = {"trade": {}, "quote": {}}
+        self._stopped = False
+
+    def subscribe_bars(self, handler, *symbols):
+        for symbol in symbols:
+            self._handlers[symbol] = handler
+
+    def unsubscribe_bars(self, *symbols):
+        for symbol in symbols:
+            self._handlers.pop(symbol, None)
+
+    def subscribe_trades(self, handler, *symbols):
+        for symbol in symbols:
+            self._tick_handlers["trade"][symbol] = handler
+
+    def subscribe_quotes(self, handler, *symbols):
+        for symbol in symbols:
+            self._tick_handlers["quote"][symbol] = handler
+
+    def unsubscribe_trades(self, *symbols):
+        for symbol in symbols:
+            self._tick_handlers["trade"].pop(symbol, None)
+
+    def unsubscribe_quotes(self, *symbols):
+        for symbol in symbols:
+            self._tick_handlers["quote"].pop(symbol, None)
+
+    def stop(self):
+        self._stopped = True
+
+    async def stop_ws(self):
+        self._stopped = True
+
+    def run(self):
+        asyncio.run(self._run_forever())
+
+    async def _monitor_loop_lag(self, interval=0.01):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            FakeDataStream.loop_lag.append(loop.time() - start - interval)
+
+    async def _run_forever(self):
+        import tasks
+
+        monitor = asyncio.create_task(self._monitor_loop_lag())
+        # speed is simulated minutes per wall-clock minute; 0 replays as fast as possible
+        pace = 60 / self.speed if self.speed else 0
+        started = time.perf_counter()
+
+        for minute, minute_bars in enumerate(self.bars):
+            if self._stopped:
+                break
+            if pace:
+                await asyncio.sleep(max(0.0, started + minute * pace - time.perf_counter()))
+            for kind, tick in self.ticks[minute] if self.ticks else ():
+                handler = self._tick_handlers[kind].get(tick.symbol)
+                if handler:
+                    await handler(tick)
+            for bar in minute_bars:
+                handler = self._handlers.get(bar.symbol)
+                if handler:
+                    FakeDataStream.last_close[bar.symbol] = bar.close
+                    bar.dispatched_at = time.perf_counter()
+                    await handler(bar)
+            await asyncio.sleep(0)
+
+        # Let in-flight handlers and orders finish before reporting
+        while tasks._background_tasks:
+            await asyncio.sleep(0.001)
+        monitor.cancel()
+        raise ReplayFinished()
+
+
+class FakeScreenerResponse:
+    movers = []
+    status_code = 200
+    headers = {}
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        half = len(self.movers) // 2
+        rows = [{"symbol": s, "percent_change": 0.0, "price": 3.0} for s in self.movers]
+        return {"gainers": rows[:half], "losers": rows[half:]}
+
+
+def install_fakes():
+    """Point every Alpaca client the bot builds at the local stand-ins (call before importing the bot)"""
+    alpaca.data.live.StockDataStream = FakeDataStream
+    alpaca.data.live.CryptoDataStream = FakeDataStream
+    alpaca.data.StockHistoricalDataClient = FakeHistoricalClient
+    alpaca.data.CryptoHistoricalDataClient = FakeHistoricalClient
+    alpaca.trading.client.TradingClient = FakeTradingClient
+    alpaca.trading.stream.TradingStream = FakeTradingStream
+    requests.Session.get = FakeScreenerResponse
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) * 1000 if len(values) else float("nan")
+
+
+def run_round(
+    market: str,
+    bars: dict,
+    n_symbols: int,
+    speed: float,
+    order_rate: float,
+    workers: int = 1,
+    ticks: int = 0,
+    order_type: str = "market",
+    batch: bool = False,
+    verbose: bool = False,
+) -> dict:
+    symbols = list(bars)[:n_symbols]
+    warmup = WARMUP_MINUTES[market]
+    FakeHistoricalClient.history = {s: bars[s][:warmup] for s in symbols}
+    FakeScreenerResponse.movers = symbols
+
+    # Minute-major order, the way the stream delivers bars when a minute closes
+    live = [bars[s][warmup:] for s in symbols]
+    FakeDataStream.bars = [list(minute_bars) for minute_bars in zip(*live)]
+    FakeDataStream.ticks = synthetic_ticks(FakeDataStream.bars, ticks) if ticks else []
+    FakeDataStream.speed = speed
+    FakeDataStream.loop_lag = []
+    FakeTradingClient.order_times = []
+
+    cache_dir = tempfile.mkdtemp(prefix="replay-bars-")
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    with output:
+        from bar_store import BarStore
+        from engine import Engine
+        from execution import Execution, FillTracker
+        from markets import MARKETS
+        from order_gateway import OrderGateway
+        from risk import RiskManager
+        from state_store import StateStore
+        from supervisor import ShardedEngine
+
+        # A fresh adapter so every round gets its own stream instance
+        adapter = type(MARKETS[market])()
+        adapter.history_start = lambda: bars[symbols[0]][0].timestamp
+        # One session spanning the replay, whatever the wall clock says
+        adapter.sessions = lambda now: [(now - timedelta(minutes=1), now + timedelta(days=1))]
+        if workers > 1:
+            engine = ShardedEngine(adapter, workers, batch)
+        else:
+            engine = Engine(adapter, microstructure=ticks > 0, batch=batch)
+        engine.store = BarStore(adapter, root=cache_dir)
+        engine.orders = OrderGateway(rate_per_minute=order_rate)
+        engine.risk = RiskManager()
+        engine.state = StateStore(os.path.join(cache_dir, "state.sqlite"))
+        engine.execution = Execution(
+            adapter, engine.ticks, order_type, fills=FillTracker(os.path.join(cache_dir, "slippage.json"))
+        )
+        latencies = []
+        on_bar = engine.on_bar
+
+        if workers > 1:
+            # on_bar only enqueues there; a bar is timed until the workers have answered for everything sent
+            waiting = []
+            on_results = engine._on_results
+
+            async def timed_on_bar(data):
+                await on_bar(data)
+                waiting.append(data.dispatched_at)
+
+            def timed_on_results(*results):
+                on_results(*results)
+                if engine.settled():
+                    now = time.perf_counter()
+                    latencies.extend(now - dispatched for dispatched in waiting)
+                    waiting.clear()
+
+            engine._on_results = timed_on_results
+        else:
+
+            async def timed_on_bar(data):
+                await on_bar(data)
+                latencies.append(time.perf_counter() - data.dispatched_at)
+
+        engine.on_bar = timed_on_bar
+        started = time.perf_counter()
+        try:
+            engine.run()
+        except ReplayFinished:
+            pass
+        elapsed = time.perf_counter() - started
+
+    orders = FakeTradingClient.order_times
+    order_span = orders[-1] - orders[0] if len(orders) > 1 else 0
+    return {
+        "symbols": len(symbols),
+        "bars": len(latencies),
+        "seconds": elapsed,
+        "bars_per_sec": len(latencies) / elapsed if elapsed else 0.0,
+        "ticks_per_sec": sum(map(len, FakeDataStream.ticks)) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50),
+        "p99_ms": percentile(latencies, 99),
+        "lag_p50_ms": percentile(FakeDataStream.loop_lag, 50),
+        "lag_p99_ms": percentile(FakeDataStream.loop_lag, 99),
+        "orders": len(orders),
+        "orders_per_sec": len(orders) / order_span if order_span else float(len(orders)),
+        "rejected": engine.orders.rejected,
+        "throttled": engine.orders.throttled,
+    }
+
+
+def print_report(results):
+    columns = ["symbols", "bars", "seconds", "bars_per_sec", "ticks_per_sec", "p50_ms", "p99_ms", "lag_p50_ms", "lag_p99_ms", "orders", "orders_per_sec", "rejected", "throttled"]
+    print(" ".join(f"{c:>14}" for c in columns))
+    for row in results:
+        print(" ".join(f"{row[c]:>14.2f}" if isinstance(row[c], float) else f"{row[c]:>14}" for c in columns))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay bars through the bot against a local Alpaca stand-in")
+    parser.add_argument("market_type", choices=["crypto", "stock"], help="Handler to benchmark")
+    parser.add_argument("--bars", help="Recorded Parquet/CSV bars (default: synthetic random walks)")
+    parser.add_argument("--symbols", type=int, nargs="+", default=[10, 100, 1000], help="Universe sizes to replay")
+    parser.add_argument("--minutes", type=int, default=60, help="Synthetic minutes replayed after warm-up")
+    parser.add_argument("--speed", type=float, default=0.0, help="Simulated minutes per real minute (0 = as fast as possible)")
+    parser.add_argument("--order-latency", type=float, default=0.03, help="Simulated REST round-trip in seconds")
+    parser.add_argument("--order-rate", type=float, default=None, help="Order submissions per minute (default: the live limit)")
+    parser.add_argument("--workers", type=int, default=1, help="Shard the universe across this many worker processes")
+    parser.add_argument("--order-type", default="market", choices=["market", "limit", "marketable"], help="How entries and exits are priced")
+    parser.add_argument("--batch", action="store_true", help="Scan each minute's bars together (batch mode)")
+    parser.add_argument("--ticks", type=int, default=0, help="Trades (and quotes) per symbol per minute, for microstructure mode")
+    parser.add_argument("--verbose", action="store_true", help="Show the bot's own output")
+    args = parser.parse_args()
+
+    # Keep the bot's logs out of ./logs and off the console unless asked for
+    os.environ.setdefault("LOG_DIR", tempfile.mkdtemp(prefix="replay-logs-"))
+    os.environ.setdefault("LOG_CONSOLE", "1" if args.verbose else "0")
+    # Every round has its own universe, so screener results must not carry over
+    os.environ.setdefault("SCREENER_CACHE_SECONDS", "0")
+    # A busy metrics port would otherwise fail every round
+    os.environ.setdefault("METRICS_PORT", "0")
+    install_fakes()
+    from order_gateway import ORDER_RATE_PER_MINUTE
+
+    order_rate = args.order_rate or ORDER_RATE_PER_MINUTE
+    FakeTradingClient.latency = args.order_latency
+    if args.bars:
+        bars = recorded_bars(args.bars)
+    else:
+        bars = synthetic_bars(args.market_type, max(args.symbols), WARMUP_MINUTES[args.market_type] + args.minutes)
+
+    results = []
+    for n_symbols in args.symbols:
+        results.append(run_round(args.market_type, bars, n_symbols, args.speed, order_rate, args.workers, args.ticks, args.order_type, args.batch, args.verbose))
+    print_report(results)
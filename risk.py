@@ -0,0 +1,187 @@
+import logging
+import threading
+import time
+from alpaca.trading.enums import OrderSide, TradeEvent
+from log import fields
+from make_orders import get_trading_client
+import metrics
+from parameters import (
+    RISK_ALLOCATION,
+    RISK_DAILY_LOSS_LIMIT,
+    RISK_MAX_GROSS_EXPOSURE,
+    RISK_MAX_POSITIONS,
+    RISK_MAX_SYMBOL_EXPOSURE,
+    RISK_RECONCILE_SECONDS,
+)
+from positions import CLOSED_EVENTS, _key, position_book
+
+logger = logging.getLogger("risk")
+
+# A reservation with no working order behind it is released after this long
+RESERVATION_TTL = 60
+
+
+class RiskManager:
+    """
+    Account snapshot and portfolio limits answered in memory.
+
+    Cash and equity come from a periodic get_account() reconcile and are
+    moved by fills between reconciles. Entries are sized from equity and
+    unreserved cash, then checked against the open position count,
+    per-symbol and gross exposure caps and the daily loss stop before they
+    are handed to the gateway. Approved entries reserve their notional
+    until a fill or cancel.
+    """
+
+    def __init__(
+        self,
+        book=position_book,
+        allocation=RISK_ALLOCATION,
+        max_positions=RISK_MAX_POSITIONS,
+        max_symbol_exposure=RISK_MAX_SYMBOL_EXPOSURE,
+        max_gross_exposure=RISK_MAX_GROSS_EXPOSURE,
+        daily_loss_limit=RISK_DAILY_LOSS_LIMIT,
+        reconcile_seconds=RISK_RECONCILE_SECONDS,
+    ):
+        self.book = book
+        self.allocation = allocation
+        self.max_positions = max_positions
+        self.max_symbol_exposure = max_symbol_exposure
+        self.max_gross_exposure = max_gross_exposure
+        self.daily_loss_limit = daily_loss_limit
+        self.reconcile_seconds = reconcile_seconds
+        self.cash = None
+        self.last_equity = None
+        self.halted = False
+        # symbol key -> last traded price, to mark positions between reconciles
+        self.marks = {}
+        # symbol key -> (notional, monotonic time) of approved entries not filled yet
+        self.reserved = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._blocked = {}
+        book.listeners.append(self.on_trade_update)
+
+    @property
+    def ready(self) -> bool:
+        return self.cash is not None
+
+    def reconcile(self, account):
+        """Replace cash and the start-of-day equity with a REST snapshot"""
+        with self._lock:
+            self.cash = float(account.cash)
+            last_equity = float(account.last_equity or account.equity)
+            if last_equity != self.last_equity:
+                # A new trading day, so the loss stop starts over
+                self.last_equity = last_equity
+                self.halted = False
+            now = time.monotonic()
+            working = {_key(o.symbol) for o in self.book.orders.values() if o.side == OrderSide.BUY}
+            self.reserved = {
+                key: (notional, at)
+                for key, (notional, at) in self.reserved.items()
+                if key in working or now - at < RESERVATION_TTL
+            }
+        self._check_daily_loss()
+
+    def refresh(self):
+        # Applied where the book is read, so the reconcile never races a decision
+        self.book.run(self.reconcile, get_trading_client().get_account())
+
+    def mark(self, symbol: str, price: float):
+        self.marks[_key(symbol)] = price
+
+    def _price(self, key):
+        return self.marks.get(key) or self.book.entry_prices.get(key, 0.0)
+
+    def exposure(self, key) -> float:
+        return self.book.positions.get(key, 0.0) * self._price(key) + self.reserved.get(key, (0.0, 0))[0]
+
+    def gross_exposure(self) -> float:
+        # Copied first: the metrics thread reads this while the loop changes the book
+        held = sum(qty * self._price(key) for key, qty in list(self.book.positions.items()))
+        return held + sum(notional for notional, _ in list(self.reserved.values()))
+
+    def equity(self) -> float:
+        """Cash plus positions at their last price"""
+        return self.cash + sum(qty * self._price(key) for key, qty in self.book.positions.items())
+
+    def size(self, price: float) -> int:
+        """Shares for a new entry: the allocation of equity, limited by cash not yet reserved"""
+        reserved = sum(notional for notional, _ in self.reserved.values())
+        budget = min(self.equity() * self.allocation, self.cash - reserved)
+        return max(0, int(budget / price))
+
+    def check_entry(self, symbol: str, qty: int, price: float):
+        """The reason an entry is refused, or None if it fits every limit"""
+        key = _key(symbol)
+        notional = qty * price
+        equity = self.equity()
+        self._check_daily_loss()
+        if self.halted:
+            reason = "daily_loss"
+        elif key in self.reserved:
+            reason = "pending_entry"
+        elif len(set(self.book.positions) | set(self.reserved)) >= self.max_positions:
+            reason = "max_positions"
+        elif self.exposure(key) + notional > equity * self.max_symbol_exposure:
+            reason = "symbol_exposure"
+        elif self.gross_exposure() + notional > equity * self.max_gross_exposure:
+            reason = "gross_exposure"
+        else:
+            return None
+        if reason not in self._blocked:
+            self._blocked[reason] = metrics.registry.counter(
+                "risk_blocked_total", "Entries refused by the risk limits", reason=reason
+            )
+        self._blocked[reason].inc()
+        return reason
+
+    def reserve(self, symbol: str, notional: float):
+        with self._lock:
+            self.reserved[_key(symbol)] = (notional, time.monotonic())
+
+    def release(self, symbol: str):
+        with self._lock:
+            self.reserved.pop(_key(symbol), None)
+
+    def on_trade_update(self, data):
+        order = data.order
+        key = _key(order.symbol)
+        with self._lock:
+            if data.event in (TradeEvent.FILL, TradeEvent.PARTIAL_FILL) and data.price is not None:
+                notional = float(data.qty or 0) * float(data.price)
+                self.marks[key] = float(data.price)
+                if self.cash is not None:
+                    self.cash += -notional if order.side == OrderSide.BUY else notional
+            if order.side == OrderSide.BUY and data.event in CLOSED_EVENTS:
+                self.reserved.pop(key, None)
+        self._check_daily_loss()
+
+    def _check_daily_loss(self):
+        if self.halted or not self.ready or not self.last_equity:
+            return
+        loss = (self.last_equity - self.equity()) / self.last_equity
+        if loss >= self.daily_loss_limit:
+            self.halted = True
+            logger.warning("daily loss stop hit, no new entries", extra=fields(loss=round(loss, 4)))
+
+    def _run(self):
+        while not self._stop.wait(self.reconcile_seconds):
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("error reconciling account")
+
+    def start(self):
+        """Reconcile in a background thread"""
+        threading.Thread(target=self._run, name="risk", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+
+risk = RiskManager()
+
+metrics.registry.gauge("risk_cash", "Cash in the local account snapshot", lambda: risk.cash or 0.0)
+metrics.registry.gauge("risk_gross_exposure", "Positions and pending entries at their last price", risk.gross_exposure)
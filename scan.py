@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import time
+import numpy as np
+from log import decisions, fields, log_decision
+import metrics
+from parameters import BATCH_TOP_K, BATCH_WAIT_SECONDS
+from positions import position_book
+from tasks import spawn
+
+logger = logging.getLogger("scan")
+
+STAGE_SCAN = metrics.stage_histogram("scan")
+
+
+async def _logged(coro, symbol):
+    try:
+        await coro
+    except Exception:
+        logger.exception("error acting on scan", extra=fields(symbol=symbol))
+
+
+class _Minute:
+    __slots__ = ("seen", "bars", "sma", "rsi", "timer")
+
+    def __init__(self):
+        self.seen = 0
+        self.bars = []
+        self.sma = []
+        self.rsi = []
+        self.timer = None
+
+
+class CrossSectionScan:
+    """
+    Batch mode: one decision per minute for the whole universe instead of
+    one per bar.
+
+    Bars are collected by minute as their indicators update. A minute is
+    scanned once every subscribed symbol has delivered its bar (and, in the
+    sharded engine, every worker has answered), or `wait` seconds after its
+    first bar, whichever comes first. The scan evaluates the entry rule for
+    the whole cross-section in one NumPy pass, ranks the signals by how deep
+    they are and submits the best `top_k` that the risk manager approves.
+    Exits are checked for every held symbol in the minute. A bar that
+    arrives after its minute was scanned is decided on its own.
+    """
+
+    def __init__(self, engine, top_k=BATCH_TOP_K, wait=BATCH_WAIT_SECONDS):
+        self.engine = engine
+        self.top_k = top_k
+        self.wait = wait
+        # bar timestamp -> _Minute still being collected
+        self.minutes = {}
+        self.scanned = None
+        # Off when the bars' decision records are logged where their indicators are (the shard workers)
+        self.records = True
+
+    def seen(self, bar):
+        """Count a bar of the universe as it arrives, whether or not it can be traded on"""
+        minute = bar.timestamp
+        if self.scanned is not None and minute <= self.scanned:
+            return
+        batch = self.minutes.get(minute)
+        if batch is None:
+            batch = self.minutes[minute] = _Minute()
+            batch.timer = asyncio.get_running_loop().call_later(self.wait, self._flush, minute)
+        batch.seen += 1
+
+    def ready(self, bar, sma, rsi):
+        """Add a bar whose indicators are ready to the scan of its minute"""
+        batch = self.minutes.get(bar.timestamp)
+        if batch is None:
+            spawn(self.engine.act_logged(bar, sma, rsi))
+            return
+        batch.bars.append(bar)
+        batch.sma.append(sma)
+        batch.rsi.append(rsi)
+
+    def check(self):
+        """Scan the minutes every symbol has reported for"""
+        if not self.engine.settled():
+            return
+        universe = len(self.engine.symbols)
+        for minute in [m for m, batch in self.minutes.items() if batch.seen >= universe]:
+            self._flush(minute)
+
+    def _flush(self, minute):
+        # Minutes are scanned in order; a minute that is due takes any older one still open with it
+        for pending in sorted(m for m in self.minutes if m <= minute):
+            batch = self.minutes.pop(pending)
+            batch.timer.cancel()
+            self.scanned = pending if self.scanned is None else max(self.scanned, pending)
+            spawn(self.scan(pending, batch))
+
+    async def scan(self, minute, batch):
+        try:
+            start = time.perf_counter()
+            if not batch.bars:
+                return
+            engine, market = self.engine, self.engine.market
+            bars = batch.bars
+            close = np.fromiter((bar.close for bar in bars), float, len(bars))
+            vwap = np.fromiter((bar.vwap for bar in bars), float, len(bars))
+            sma = np.asarray(batch.sma, dtype=float)
+            rsi = np.asarray(batch.rsi, dtype=float)
+            enter = market.entry_signals(close, vwap, sma, rsi)
+            scores = market.entry_scores(close, sma, rsi)
+            # Deepest signals first; stable so ties keep arrival order
+            candidates = np.flatnonzero(enter)
+            candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+            STAGE_SCAN.observe(time.perf_counter() - start)
+            metrics.decision_lag.observe(time.time() - minute.timestamp() - 60)
+
+            for i in range(len(bars)):
+                if self.records and log_decision(bars[i].symbol):
+                    record = market.describe_decision(bars[i], sma[i], rsi[i])
+                    decisions.debug("decision", extra={"fields": {**record, "score": float(scores[i])}})
+
+            for i in np.flatnonzero(~enter):
+                has_position, qty = position_book.position(bars[i].symbol)
+                if has_position and position_book.entry_price(bars[i].symbol) is not None:
+                    spawn(_logged(engine.consider_exit(bars[i], sma[i], qty), bars[i].symbol))
+
+            submitted = 0
+            if len(candidates) and not engine.risk.ready:
+                await engine.account_ready()
+            for i in candidates:
+                if submitted >= self.top_k:
+                    break
+                bar = bars[i]
+                if position_book.position(bar.symbol)[0] or position_book.open_orders(bar.symbol):
+                    continue
+                shares = engine.approve_entry(bar)
+                if shares:
+                    spawn(_logged(engine.submit_entry(bar, shares), bar.symbol))
+                    submitted += 1
+            logger.info(
+                "minute scanned",
+                extra=fields(
+                    minute=minute.isoformat(), bars=len(bars), signals=len(candidates), submitted=submitted
+                ),
+            )
+        except Exception:
+            logger.exception("error scanning minute", extra=fields(minute=minute.isoformat()))
@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from log import fields
+from parameters import ENTRY_CUTOFF_MINUTES, SHUTDOWN_DELAY_MINUTES
+from tasks import spawn
+
+logger = logging.getLogger("session")
+
+# In the order they happen
+EVENTS = ("open", "cutoff", "flatten", "shutdown")
+
+
+class SessionScheduler:
+    """
+    Session events as timers on the stream's event loop.
+
+    plan() works the schedule out once from the market calendar: entries
+    open, no new entries `cutoff` minutes before the flatten, flatten, and
+    shutdown `shutdown_delay` minutes after it. arm() sets one timer per
+    event on the running loop; events already due fire right away, in
+    order. Each event fires exactly once, even if the stream restarts and
+    the timers are armed again on the new loop, and each runs only after
+    the one before it has finished.
+    """
+
+    def __init__(self, engine, cutoff=ENTRY_CUTOFF_MINUTES, shutdown_delay=SHUTDOWN_DELAY_MINUTES):
+        self.engine = engine
+        self.cutoff = timedelta(minutes=cutoff)
+        self.shutdown_delay = timedelta(minutes=shutdown_delay)
+        # (event, UTC datetime) in EVENTS order
+        self.events = []
+        self.fired = set()
+        self._handles = []
+        self._last = None
+
+    def plan(self, now=None):
+        """Schedule the first session that has not shut down yet"""
+        now = now or datetime.now(timezone.utc)
+        for start, flatten in self.engine.market.sessions(now):
+            if flatten + self.shutdown_delay > now:
+                break
+        else:
+            raise RuntimeError(f"no {self.engine.market.name} session in the calendar after {now}")
+        times = (start, max(start, flatten - self.cutoff), flatten, flatten + self.shutdown_delay)
+        self.events = list(zip(EVENTS, times))
+        logger.info("session scheduled", extra=fields(**{name: when.isoformat() for name, when in self.events}))
+        return self.events
+
+    def arm(self):
+        """Set the timers on the running loop; called whenever the stream (re)starts"""
+        loop = asyncio.get_running_loop()
+        for handle in self._handles:
+            handle.cancel()
+        self._last = None
+        now = time.time()
+        self._handles = []
+        for i, (name, when) in enumerate(self.events):
+            if name in self.fired:
+                continue
+            if when.timestamp() <= now:
+                # Started late: queued now, ahead of the first bar's task
+                self._fire(i)
+            else:
+                self._handles.append(loop.call_later(when.timestamp() - now, self._fire, i))
+
+    def _fire(self, index):
+        # Timers due together may run in any order, so earlier events go first
+        for name, when in self.events[: index + 1]:
+            if name in self.fired:
+                continue
+            self.fired.add(name)
+            logger.info("session event", extra=fields(event=name, scheduled=when.isoformat()))
+            self._last = spawn(self._run(name, self._last))
+
+    async def _run(self, name, previous):
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        try:
+            await getattr(self.engine, f"on_session_{name}")()
+        except Exception:
+            logger.exception("error handling session event", extra=fields(event=name))
@@ -0,0 +1,208 @@
+import argparse
+import atexit
+import logging
+import pickle
+import queue
+import sqlite3
+import threading
+import time
+from datetime import timedelta
+from functools import partial
+from pathlib import Path
+from types import SimpleNamespace
+from alpaca.trading.enums import OrderSide
+from log import fields
+from parameters import STATE_DIR
+from positions import CLOSED_EVENTS, _key
+
+logger = logging.getLogger("state")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entry_prices (symbol TEXT PRIMARY KEY, price REAL, qty REAL, updated REAL);
+CREATE TABLE IF NOT EXISTS orders (order_id TEXT PRIMARY KEY, symbol TEXT, side TEXT, updated REAL);
+CREATE TABLE IF NOT EXISTS indicators (symbol TEXT PRIMARY KEY, bar_time REAL, state BLOB);
+"""
+
+# Statements a write batch is made of; one transaction per batch
+UPSERT_ENTRY = "INSERT OR REPLACE INTO entry_prices VALUES (?, ?, ?, ?)"
+DELETE_ENTRY = "DELETE FROM entry_prices WHERE symbol = ?"
+UPSERT_ORDER = "INSERT OR REPLACE INTO orders VALUES (?, ?, ?, ?)"
+DELETE_ORDER = "DELETE FROM orders WHERE order_id = ?"
+UPSERT_INDICATORS = "INSERT OR REPLACE INTO indicators VALUES (?, ?, ?)"
+
+# Writes a batch may hold before it is committed
+BATCH_SIZE = 1000
+
+
+class StateStore:
+    """
+    Entry prices, working order ids and indicator checkpoints in SQLite (WAL).
+
+    Writers only enqueue; a background thread commits whatever has queued
+    up as one transaction, so nothing on the event loop waits on disk.
+    Rows are keyed by symbol or order id and overwritten in place, and
+    compact() drops stale rows and truncates the WAL.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._queue = queue.SimpleQueue()
+        self._writer = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        return conn
+
+    def _put(self, sql, params):
+        if self._writer is None:
+            with self._lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._write_loop, name="state-writer", daemon=True)
+                    self._writer.start()
+                    atexit.register(self.close)
+        self._queue.put((sql, params))
+
+    def _write_loop(self):
+        conn = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            try:
+                while len(batch) < BATCH_SIZE:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            stop = None in batch
+            try:
+                with conn:
+                    for item in batch:
+                        if item is not None:
+                            conn.execute(*item)
+            except sqlite3.Error:
+                logger.exception("error writing state", extra=fields(writes=len(batch)))
+            if stop:
+                conn.close()
+                return
+
+    def close(self):
+        """Commit what is queued and stop the writer"""
+        if self._writer is not None and self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join(timeout=10)
+
+    # Position book
+
+    def save_entry(self, symbol: str, price, qty):
+        if price is None or not qty:
+            self._put(DELETE_ENTRY, (symbol,))
+        else:
+            self._put(UPSERT_ENTRY, (symbol, price, qty, time.time()))
+
+    def save_order(self, order, working: bool):
+        if working:
+            self._put(UPSERT_ORDER, (str(order.id), order.symbol, order.side.value, time.time()))
+        else:
+            self._put(DELETE_ORDER, (str(order.id),))
+
+    def save_book(self, book):
+        """Replace the stored book with a reconciled snapshot"""
+        self._put("DELETE FROM entry_prices", ())
+        self._put("DELETE FROM orders", ())
+        for symbol, qty in book.positions.items():
+            self.save_entry(symbol, book.entry_prices.get(symbol), qty)
+        for order in book.orders.values():
+            self.save_order(order, True)
+
+    def attach(self, book):
+        """Mirror every trade update and reconcile of `book` to disk"""
+        book.listeners.append(partial(self.on_trade_update, book))
+        book.reconcile_listeners.append(self.save_book)
+
+    def on_trade_update(self, book, data):
+        """Mirror the entry and order a trade update touched"""
+        key = _key(data.order.symbol)
+        self.save_entry(key, book.entry_prices.get(key), book.positions.get(key, 0.0))
+        self.save_order(data.order, data.event not in CLOSED_EVENTS)
+
+    def restore_book(self, book):
+        """Seed a book from disk, for use until (or if) the REST reconcile succeeds"""
+        if not self.path.exists():
+            return
+        conn = self._connect()
+        try:
+            for symbol, price, qty in conn.execute("SELECT symbol, price, qty FROM entry_prices"):
+                book.positions[symbol] = qty
+                book.entry_prices[symbol] = price
+            for order_id, symbol, side in conn.execute("SELECT order_id, symbol, side FROM orders"):
+                book.orders[order_id] = SimpleNamespace(id=order_id, symbol=symbol, side=OrderSide(side))
+        finally:
+            conn.close()
+        logger.info("restored book", extra=fields(positions=len(book.positions), open_orders=len(book.orders)))
+
+    # Indicator checkpoints
+
+    def save_indicators(self, indicators: dict):
+        """Checkpoint indicator state; pickled here, written on the writer thread"""
+        for symbol, state in indicators.items():
+            if state.timestamp is not None:
+                self._put(UPSERT_INDICATORS, (symbol, state.timestamp.timestamp(), pickle.dumps(state)))
+
+    def load_indicators(self, symbols) -> dict:
+        if not self.path.exists():
+            return {}
+        conn = self._connect()
+        try:
+            saved = {}
+            symbols = list(symbols)
+            for i in range(0, len(symbols), 500):
+                chunk = symbols[i : i + 500]
+                rows = conn.execute(
+                    f"SELECT symbol, state FROM indicators WHERE symbol IN ({','.join('?' * len(chunk))})", chunk
+                )
+                saved.update((symbol, pickle.loads(state)) for symbol, state in rows)
+            return saved
+        finally:
+            conn.close()
+
+    def compact(self, max_age=timedelta(days=3)):
+        """Drop checkpoints of symbols not traded lately and keep the files small"""
+        if not self.path.exists():
+            return
+        conn = self._connect()
+        try:
+            with conn:
+                cutoff = time.time() - max_age.total_seconds()
+                dropped = conn.execute("DELETE FROM indicators WHERE bar_time < ?", (cutoff,)).rowcount
+            free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            pages = conn.execute("PRAGMA page_count").fetchone()[0]
+            if pages and free / pages > 0.25:
+                conn.execute("VACUUM")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        finally:
+            conn.close()
+        logger.info("compacted state", extra=fields(dropped_checkpoints=dropped))
+
+
+def state_path(market_name: str) -> Path:
+    return Path(STATE_DIR) / f"state-{market_name}.sqlite"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or compact the bot's local state")
+    parser.add_argument("market_type", choices=["crypto", "stock"], help="Bot whose state to open")
+    parser.add_argument("--compact", action="store_true", help="Drop stale checkpoints and truncate the WAL")
+    args = parser.parse_args()
+
+    store = StateStore(state_path(args.market_type))
+    if args.compact:
+        store.compact()
+    from positions import PositionBook
+
+    book = PositionBook()
+    store.restore_book(book)
+    print(f"Entry prices: {book.entry_prices}")
+    print(f"Working orders: {len(book.orders)}")
@@ -0,0 +1,219 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from datetime import datetime, timezone
+from bar_store import plain
+from log import fields
+import metrics
+from parameters import CHECKPOINT_MAX_AGE, CHECKPOINT_SECONDS
+
+logger = logging.getLogger("stream")
+
+STREAM_RESTARTS = metrics.registry.counter("stream_restarts_total", "Times the data stream was restarted")
+GAPS_DETECTED = metrics.registry.counter("bar_gaps_total", "Jumps in bar timestamps that history had bars for")
+BARS_BACKFILLED = metrics.registry.counter("bars_backfilled_total", "Bars recovered by gap backfills")
+
+
+def load_checkpoint(store, max_age=CHECKPOINT_MAX_AGE):
+    """Symbols traded before a restart, if the checkpoint is recent enough to resume from"""
+    path = store.root / "checkpoint.json"
+    if not path.exists():
+        return None
+    checkpoint = json.loads(path.read_text())
+    if time.time() - checkpoint["saved_at"] > max_age:
+        return None
+    return checkpoint["symbols"]
+
+
+class StreamRunner:
+    """
+    Keeps the data stream running and the bar history whole.
+
+    alpaca-py reconnects dropped sockets itself; run() also restarts the
+    stream with jittered backoff if it returns or raises before the session
+    is over. Every bar is checked against the last one seen for its symbol;
+    skipped minutes are checked with one batched history call per interval,
+    and only the ones history has a bar for are folded into the engine's
+    state; most are minutes a thin symbol simply didn't trade. Live bars
+    are persisted to the bar store and indicators to the state store,
+    together with a checkpoint of the universe, so a restart resumes from
+    disk and only fetches what it missed.
+    """
+
+    def __init__(self, engine, interval=CHECKPOINT_SECONDS, max_backoff=60.0):
+        self.engine = engine
+        self.interval = interval
+        self.max_backoff = max_backoff
+        # symbol -> epoch seconds of its newest bar
+        self.last_seen = {}
+        # symbol -> [(first skipped minute, minute of the bar after)] in epoch seconds
+        self.gaps = {}
+        self.unsaved = defaultdict(list)
+        # The loop the stream is being served on
+        self.loop = None
+        self._loop = None
+        self._task = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint")
+
+    def seed(self, bars_by_symbol: dict):
+        """Start gap tracking from the newest warm-up bar of each symbol"""
+        for symbol, bars in bars_by_symbol.items():
+            if bars:
+                self.last_seen[symbol] = int(bars[-1].timestamp.timestamp())
+
+    def forget(self, symbol: str):
+        self.last_seen.pop(symbol, None)
+        self.gaps.pop(symbol, None)
+
+    def observe(self, bar):
+        """Called for every streamed bar before it is evaluated; returns the bar as it will be stored"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # First bar on this (possibly restarted) loop
+            self._loop = loop
+            # Not a background task: the replay waits for those to finish
+            self._task = loop.create_task(self._maintain())
+
+        ts = int(bar.timestamp.timestamp())
+        last = self.last_seen.get(bar.symbol)
+        if last is not None:
+            if ts - last > 60:
+                self.gaps.setdefault(bar.symbol, []).append((last + 60, ts))
+            if ts < last:
+                ts = last
+        self.last_seen[bar.symbol] = ts
+        stored = plain(bar)
+        self.unsaved[bar.symbol].append(stored)
+        return stored
+
+    async def _maintain(self):
+        loop = asyncio.get_running_loop()
+        while loop is self._loop:
+            await asyncio.sleep(self.interval)
+            gaps, self.gaps = self.gaps, {}
+            unsaved, self.unsaved = self.unsaved, defaultdict(list)
+            persisted = False
+            try:
+                self.engine.checkpoint_state()
+                fetched = await loop.run_in_executor(self._executor, self._persist, gaps, unsaved)
+                persisted = True
+                self._backfill(gaps, fetched)
+            except Exception:
+                logger.exception("error persisting bars")
+                if not persisted:
+                    self._requeue(gaps, unsaved)
+
+    def _requeue(self, gaps: dict, unsaved: dict):
+        """Put back what a failed interval took, ahead of what arrived since"""
+        for symbol, ranges in gaps.items():
+            if symbol in self.last_seen:
+                self.gaps[symbol] = ranges + self.gaps.get(symbol, [])
+        for symbol, bars in unsaved.items():
+            self.unsaved[symbol][:0] = bars
+
+    def _backfill(self, gaps: dict, fetched: dict):
+        # Every gap symbol is passed on, with no bars if its skipped minutes had no trades
+        missing = {}
+        for symbol, ranges in gaps.items():
+            bars = fetched.get(symbol, ())
+            found = [[bar for bar in bars if start <= bar.timestamp.timestamp() < end] for start, end in ranges]
+            missing[symbol] = [bar for in_range in found for bar in in_range]
+            GAPS_DETECTED.inc(sum(1 for in_range in found if in_range))
+            BARS_BACKFILLED.inc(len(missing[symbol]))
+        self.engine.backfill(missing)
+        recovered = sum(1 for bars in missing.values() if bars)
+        if recovered:
+            logger.info("backfilled gaps", extra=fields(symbols=recovered))
+
+    def _persist(self, gaps: dict, unsaved: dict) -> dict:
+        """Executor thread: fetch history over the gaps, store live bars, then write the checkpoint"""
+        store = self.engine.store
+        fetched = {}
+        if gaps:
+            start = datetime.fromtimestamp(min(start for ranges in gaps.values() for start, _ in ranges), timezone.utc)
+            fetched = store.fetch_range(gaps, start)
+        store.append(unsaved)
+        self.checkpoint()
+        return fetched
+
+    def flush(self):
+        """Persist what the last interval collected once the stream has stopped"""
+        gaps, self.gaps = self.gaps, {}
+        unsaved, self.unsaved = self.unsaved, defaultdict(list)
+        try:
+            self.engine.checkpoint_state()
+            self._persist(gaps, unsaved)
+        except Exception:
+            logger.exception("error persisting bars")
+
+    def checkpoint(self):
+        path = self.engine.store.root / "checkpoint.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"saved_at": time.time(), "symbols": list(self.last_seen)}))
+        os.replace(tmp, path)
+
+    def call(self, callback, *args):
+        """
+        From another thread: run `callback` on the stream's loop, where the
+        engine's state lives, and wait for its result. Runs it directly if no
+        stream is being served, if called on the loop itself, or if the
+        stream stops before it got to it.
+        """
+        loop = self.loop
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if loop is None or not loop.is_running() or running is loop:
+            return callback(*args)
+        future = Future()
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(callback(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+        loop.call_soon_threadsafe(run)
+        while True:
+            try:
+                return future.result(timeout=1.0)
+            except TimeoutError:
+                if not loop.is_running() and future.cancel():
+                    return callback(*args)
+
+    async def _serve(self):
+        self.loop = asyncio.get_running_loop()
+        # The session timers go on the stream's loop before its first bar
+        self.engine.session.arm()
+        await self.engine.market.stream._run_forever()
+
+    def run(self):
+        """Run the stream until the session is over, restarting it with backoff"""
+        retries = 0
+        while True:
+            started = time.monotonic()
+            try:
+                asyncio.run(self._serve())
+            except KeyboardInterrupt:
+                return
+            except Exception:
+                logger.exception("data stream failed")
+            if self.engine.session_over:
+                return
+            if time.monotonic() - started > self.max_backoff:
+                retries = 0
+            retries += 1
+            delay = min(self.max_backoff, 2**retries) * random.uniform(0.5, 1.0)
+            STREAM_RESTARTS.inc()
+            logger.warning("data stream stopped, restarting", extra=fields(retry=retries, delay=round(delay, 1)))
+            self.engine.on_stream_restart()
+            time.sleep(delay)
@@ -0,0 +1,432 @@
+import asyncio
+import logging
+import math
+import multiprocessing
+import queue
+import threading
+import time
+import zlib
+from collections import defaultdict
+from bar_store import StoredBar
+from engine import Engine
+from log import decisions, fields, setup_logging
+from make_orders import order_executor
+import metrics
+from positions import _key, position_book
+from tasks import spawn
+
+logger = logging.getLogger("supervisor")
+
+# Messages a worker drains from its inbox before replying
+WORKER_BATCH = 1000
+# How long the first warm-up waits for the workers to come up
+WORKER_START_SECONDS = 30.0
+# How often the results reader checks that every worker is still alive
+WORKER_CHECK_SECONDS = 1.0
+
+WORKER_RESTARTS = metrics.registry.counter("shard_worker_restarts_total", "Worker processes that died and were restarted")
+
+# The engine shard_pending_bars reports on; registered once, whichever engine is newest
+_current = None
+metrics.registry.gauge(
+    "shard_pending_bars", "Bars sent to workers and not evaluated yet", lambda: _current.pending if _current else 0
+)
+
+
+def shard_of(symbol: str, shards: int) -> int:
+    # Stable across processes and restarts, unlike hash()
+    return zlib.crc32(symbol.encode()) % shards
+
+
+class ShardWorker:
+    """
+    The per-bar half of the engine, run in a worker process: updates the
+    shard's windows and indicators and turns each bar into an intent for
+    the main process. `held` is the entry price of every position, as last
+    sent by the main process.
+    """
+
+    def __init__(self, engine, batch, records):
+        from log import SymbolSampler
+        from parameters import LOG_DECISION_SAMPLE
+
+        self.engine = engine
+        self.batch = batch
+        self.sampler = SymbolSampler(LOG_DECISION_SAMPLE) if records else None
+        self.held = {}
+
+    def evaluate(self, bar, intents):
+        inputs = self.engine.update(bar)
+        if inputs is None:
+            return
+        sma, rsi = inputs
+        market = self.engine.market
+        if self.sampler is not None and self.sampler(bar.symbol):
+            intents.append(("record", bar, market.describe_decision(bar, sma, rsi)))
+        if market.entry_signal(bar, sma, rsi):
+            atr = self.engine.atr(bar.symbol)
+            intents.append(("signal", bar, (sma, rsi, atr)) if self.batch else ("enter", bar, atr))
+            return
+        entry_price = self.held.get(_key(bar.symbol))
+        if entry_price is not None:
+            leave = market.exit_signal(bar, sma, entry_price)
+            intents.append(("exit", bar, sma) if leave else ("mark", bar, None))
+
+
+def _work(shard: int, market_name: str, state_path, batch: bool, records: bool, inbox, outbox):
+    """
+    Worker process: keeps the bar windows and indicators of its shard,
+    checkpoints them to the shared state store and decides on every bar.
+    For each batch it replies with how many bars it processed, the newest
+    bar's timestamp and the intents they produced. Any message that fails
+    is reported back instead of ending the process.
+    """
+    from markets import MARKETS
+    from state_store import StateStore
+
+    engine = Engine(MARKETS[market_name])
+    engine.state = StateStore(state_path)
+    worker = ShardWorker(engine, batch, records)
+    outbox.put(("started", shard))
+    while True:
+        messages = [inbox.get()]
+        try:
+            while len(messages) < WORKER_BATCH:
+                messages.append(inbox.get_nowait())
+        except queue.Empty:
+            pass
+
+        processed = 0
+        newest = None
+        intents = []
+        for kind, payload in messages:
+            if kind == "stop":
+                engine.state.close()
+                return
+            try:
+                if kind == "bars":
+                    for values in payload:
+                        bar = StoredBar._make(values)
+                        processed += 1
+                        try:
+                            worker.evaluate(bar, intents)
+                        except Exception as e:
+                            outbox.put(("error", shard, kind, bar.symbol, repr(e)))
+                    newest = bar.timestamp.timestamp()
+                elif kind == "held":
+                    worker.held = payload
+                elif kind == "warm":
+                    engine.load_state(*payload)
+                elif kind == "checkpoint":
+                    engine.checkpoint_state()
+                elif kind == "backfill":
+                    engine.backfill(payload)
+                elif kind == "drop":
+                    engine.drop(payload)
+            except Exception as e:
+                outbox.put(("error", shard, kind, None, repr(e)))
+        if processed:
+            outbox.put(("done", shard, processed, newest, intents))
+
+
+class ShardedEngine(Engine):
+    """
+    Supervisor mode: one stream connection fans bars out to worker processes
+    by symbol shard. Workers own the bar windows and indicators and make the
+    per-bar decision; what comes back is only the bars that need action, as
+    entry, exit and mark intents. This process is the single owner of the
+    position book, risk and orders: it approves every intent through the
+    risk manager and the order gateway, and tells the workers which
+    positions are held.
+
+    Per bar, this process only tracks gaps and appends the bar to its
+    shard's outgoing batch; the batches go out once per pass of the event
+    loop. In batch mode the workers send the minute's entry signals to the
+    scan here, while exits are acted on as they arrive.
+
+    A worker that dies is logged, restarted and warmed again from the bar
+    and state stores; the bars it had not answered for are lost.
+    """
+
+    def __init__(self, market, workers: int, batch=False):
+        super().__init__(market, batch=batch)
+        self.workers = workers
+        self.pending = 0
+        # Per shard: bars sent and not answered yet, and bars waiting for the next send
+        self._pending = [0] * workers
+        self._outgoing = [[] for _ in range(workers)]
+        self._flushing = False
+        # symbol -> shard
+        self._shards = {}
+        # symbol -> ATR sent with its latest entry signal, for the brackets
+        self._atr = {}
+        # Entry prices of the held positions as last sent to the workers
+        self._held = None
+        self._drained = None
+        self._loop = None
+        self._records = False
+        self._warmed = False
+        self._stopping = False
+        # Shards being restarted, whose bars are held back until they are warm again
+        self._restarting = set()
+        self._context = multiprocessing.get_context("spawn")
+        self._outbox = self._context.Queue()
+        self._inboxes = [self._context.Queue() for _ in range(workers)]
+        self._processes = [None] * workers
+        self._started = [threading.Event() for _ in range(workers)]
+        if self.scanner is not None:
+            # The workers log the decision records, next to the indicators
+            self.scanner.records = False
+        global _current
+        _current = self
+
+    def adopt(self, bars, states):
+        """Hand each worker the history and checkpoints of its shard"""
+        self.symbols.update(bars)
+        self.runner.seed(bars)
+        if not self._warmed:
+            # The first warm-up overlaps the workers' start; later ones find them running
+            for started in self._started:
+                started.wait(WORKER_START_SECONDS)
+            self._warmed = True
+        shards = defaultdict(lambda: ({}, {}))
+        for symbol, symbol_bars in bars.items():
+            shard = self._shards[symbol] = shard_of(symbol, self.workers)
+            shards[shard][0][symbol] = symbol_bars
+            if symbol in states:
+                shards[shard][1][symbol] = states[symbol]
+        for shard, payload in shards.items():
+            self._inboxes[shard].put(("warm", payload))
+        self._sync_held()
+
+    def atr(self, symbol):
+        return self._atr.get(symbol, math.nan)
+
+    def backfill(self, bars_by_symbol):
+        # The backfill replays the bars streamed since the gap, so those go first
+        self._flush()
+        shards = defaultdict(dict)
+        for symbol, symbol_bars in bars_by_symbol.items():
+            if symbol in self._shards:
+                shards[self._shards[symbol]][symbol] = symbol_bars
+        for shard, shard_bars in shards.items():
+            self._inboxes[shard].put(("backfill", shard_bars))
+
+    def checkpoint_state(self):
+        for inbox in self._inboxes:
+            inbox.put(("checkpoint", None))
+
+    def on_stream_restart(self):
+        # Replies for bars sent on the old loop are not waited for
+        self._flush()
+        self.pending = 0
+        self._pending = [0] * self.workers
+        self._drained = None
+
+    def settled(self):
+        return self.pending == 0
+
+    def drop(self, symbol):
+        self.symbols.discard(symbol)
+        self.runner.forget(symbol)
+        self._atr.pop(symbol, None)
+        shard = self._shards.pop(symbol, None)
+        if shard is not None:
+            # Bars still buffered would bring the symbol back in the worker after the drop
+            self._flush()
+            self._inboxes[shard].put(("drop", symbol))
+
+    def _sync_held(self, *_):
+        """Send the workers the held positions' entry prices when they change"""
+        book = position_book
+        held = {key: book.entry_prices.get(key) for key, qty in book.positions.items() if qty > 0}
+        held = {key: price for key, price in held.items() if price is not None}
+        if held != self._held:
+            self._held = held
+            for inbox in self._inboxes:
+                inbox.put(("held", held))
+
+    def handler(self):
+        # Enqueueing never waits, so bars need no task of their own
+        return self.on_bar
+
+    async def on_bar(self, data):
+        if data.symbol not in self.symbols:
+            return
+        metrics.bars_received.inc()
+        bar = self.runner.observe(data)
+        if self.scanner is not None:
+            self.scanner.seen(data)
+        if not self.market.accepts(data):
+            metrics.bars_filtered.inc()
+        if self.pending == 0:
+            # Results are handed back on the stream's loop
+            self._loop = asyncio.get_running_loop()
+            self._drained = asyncio.Event()
+            # Held in the background task set until the workers catch up
+            spawn(self._drained.wait())
+        self.pending += 1
+        self._outgoing[self._shards[data.symbol]].append(bar)
+        if not self._flushing:
+            # Everything the stream delivers in this pass of the loop goes out in one message per shard
+            self._flushing = True
+            self._loop.call_soon(self._flush)
+
+    def _flush(self):
+        self._flushing = False
+        for shard, bars in enumerate(self._outgoing):
+            if bars and shard not in self._restarting:
+                self._outgoing[shard] = []
+                self._pending[shard] += len(bars)
+                # Plain tuples pickle several times faster than the namedtuples
+                self._inboxes[shard].put(("bars", [tuple(bar) for bar in bars]))
+
+    def _on_results(self, shard, processed, newest, intents):
+        # Minute bars are stamped with their open, so the newest one closed a minute later
+        metrics.decision_lag.observe(time.time() - newest - 60)
+        for kind, bar, value in intents:
+            if kind == "mark":
+                self.risk.mark(bar.symbol, bar.close)
+            elif kind == "exit":
+                spawn(self._exit(bar, value))
+            elif kind == "enter":
+                self._atr[bar.symbol] = value
+                spawn(self._enter(bar))
+            elif kind == "signal":
+                sma, rsi, self._atr[bar.symbol] = value
+                self.scanner.ready(bar, sma, rsi)
+            elif kind == "record":
+                decisions.debug("decision", extra={"fields": value})
+        self._pending[shard] = max(0, self._pending[shard] - processed)
+        self.pending = max(0, self.pending - processed)
+        self._settle()
+
+    def _settle(self):
+        if self.scanner is not None:
+            self.scanner.check()
+        if self.pending == 0 and self._drained is not None:
+            self._drained.set()
+
+    async def _enter(self, bar):
+        try:
+            await self.enter(bar)
+        except Exception:
+            logger.exception("error acting on entry", extra=fields(symbol=bar.symbol))
+
+    async def _exit(self, bar, sma):
+        try:
+            # The worker decided on the entry price it was last sent; the book has the final word
+            has_position, qty = position_book.position(bar.symbol)
+            if has_position and position_book.entry_price(bar.symbol) is not None:
+                await self.consider_exit(bar, sma, qty)
+        except Exception:
+            logger.exception("error acting on exit", extra=fields(symbol=bar.symbol))
+
+    def _start(self, shard):
+        process = self._context.Process(
+            target=_work,
+            args=(
+                shard,
+                self.market.name,
+                self.state.path,
+                self.scanner is not None,
+                self._records,
+                self._inboxes[shard],
+                self._outbox,
+            ),
+            name=f"shard-{shard}",
+            daemon=True,
+        )
+        process.start()
+        self._processes[shard] = process
+
+    def _check_workers(self):
+        """Reader thread: restart the workers that died"""
+        for shard, process in enumerate(self._processes):
+            if process is None or process.exitcode is None or self._stopping:
+                continue
+            logger.error("worker died", extra=fields(shard=shard, exitcode=process.exitcode))
+            WORKER_RESTARTS.inc()
+            self._processes[shard] = None
+            self.runner.call(self._restart, shard)
+
+    def _restart(self, shard):
+        # Whatever the dead worker had queued is gone, replies included
+        self.pending = max(0, self.pending - self._pending[shard])
+        self._pending[shard] = 0
+        self._restarting.add(shard)
+        self._inboxes[shard] = self._context.Queue()
+        self._start(shard)
+        symbols = [symbol for symbol, s in self._shards.items() if s == shard]
+        history = order_executor.submit(self.history, symbols)
+        history.add_done_callback(lambda future: self.runner.call(self._rewarm, shard, future))
+        self._settle()
+
+    def _rewarm(self, shard, history):
+        try:
+            bars, states = history.result()
+        except Exception:
+            logger.exception("error reloading worker history", extra=fields(shard=shard))
+            bars, states = {}, {}
+        # Symbols dropped while the history loaded stay dropped
+        bars = {symbol: symbol_bars for symbol, symbol_bars in bars.items() if self._shards.get(symbol) == shard}
+        states = {symbol: state for symbol, state in states.items() if symbol in bars}
+        inbox = self._inboxes[shard]
+        inbox.put(("warm", (bars, states)))
+        inbox.put(("held", self._held or {}))
+        # Bars held back during the restart that the history already covers would be counted twice
+        newest = {symbol: symbol_bars[-1].timestamp for symbol, symbol_bars in bars.items() if symbol_bars}
+        held_back = self._outgoing[shard]
+        kept = [bar for bar in held_back if bar.symbol not in newest or bar.timestamp > newest[bar.symbol]]
+        self.pending = max(0, self.pending - (len(held_back) - len(kept)))
+        self._outgoing[shard] = kept
+        self._restarting.discard(shard)
+        logger.info("worker restarted", extra=fields(shard=shard, symbols=len(bars)))
+        self._flush()
+        self._settle()
+
+    def _read_results(self):
+        checked = time.monotonic()
+        while True:
+            try:
+                message = self._outbox.get(timeout=WORKER_CHECK_SECONDS)
+            except queue.Empty:
+                message = ()
+            if message is None:
+                return
+            if time.monotonic() - checked >= WORKER_CHECK_SECONDS:
+                self._check_workers()
+                checked = time.monotonic()
+            if not message:
+                continue
+            if message[0] == "started":
+                self._started[message[1]].set()
+            elif message[0] == "error":
+                shard, kind, symbol, error = message[1:]
+                logger.error("worker failed", extra=fields(shard=shard, message=kind, symbol=symbol, error=error))
+            elif self._loop is not None:
+                self._loop.call_soon_threadsafe(self._on_results, *message[1:])
+
+    def run(self):
+        # Set up first so the workers know whether decision records are wanted
+        setup_logging(self.market.name)
+        self._records = decisions.isEnabledFor(logging.DEBUG)
+        for shard in range(self.workers):
+            self._start(shard)
+        reader = threading.Thread(target=self._read_results, name="shard-results", daemon=True)
+        reader.start()
+        position_book.listeners.append(self._sync_held)
+        position_book.reconcile_listeners.append(self._sync_held)
+        try:
+            super().run()
+        finally:
+            self._stopping = True
+            position_book.listeners.remove(self._sync_held)
+            position_book.reconcile_listeners.remove(self._sync_held)
+            for inbox in self._inboxes:
+                inbox.put(("stop", None))
+            for process in self._processes:
+                if process is not None:
+                    process.join(timeout=5)
+            self._outbox.put(None)
+            reader.join(timeout=5)
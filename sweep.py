@@ -0,0 +1,161 @@
+import argparse
+import csv
+import itertools
+import math
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+import numpy as np
+from backtest import DEFAULT_PARAMS, build_panel, load_bars, run_backtest
+
+# Panel and settings loaded once per worker process
+_panel = None
+_market = None
+_starting_cash = None
+
+
+# Parameters that only shape the brackets of one sizing mode
+SIZING_PARAMS = {
+    "atr": ("atr_window", "stop_atr", "take_profit_atr"),
+    "percent": ("stop_factor", "take_profit_factor"),
+}
+
+
+def _value(name, value):
+    if name == "bracket_sizing":
+        if value not in SIZING_PARAMS:
+            raise ValueError(f"bracket_sizing must be one of {', '.join(SIZING_PARAMS)}: {value}")
+        return value
+    return int(value) if name.endswith("_window") else float(value)
+
+
+def parse_grid(specs) -> dict:
+    """
+    Parse `name=v1,v2,...` specs into a parameter grid. Varying a bracket
+    parameter that none of the swept sizing modes use is rejected, since
+    every row would come out the same.
+    """
+    grid = {}
+    for spec in specs:
+        name, values = spec.split("=", 1)
+        if name not in DEFAULT_PARAMS["stock"]:
+            raise ValueError(f"Unknown parameter: {name}")
+        grid[name] = [_value(name, v) for v in values.split(",")]
+    sizings = grid.get("bracket_sizing", [DEFAULT_PARAMS["stock"]["bracket_sizing"]])
+    for sizing, names in SIZING_PARAMS.items():
+        unused = [name for name in names if len(grid.get(name, ())) > 1]
+        if unused and sizing not in sizings:
+            raise ValueError(f"{', '.join(unused)} only apply with bracket_sizing={sizing}")
+    return grid
+
+
+def combinations(grid: dict):
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+
+
+def save_panel(panel: dict, directory) -> Path:
+    """Write every panel array to its own .npy file so workers can memory-map them"""
+    directory = Path(directory)
+    for name, values in panel.items():
+        if name == "symbols":
+            values = values.astype(str)
+        np.save(directory / f"{name}.npy", values)
+    return directory
+
+
+def load_panel(directory) -> dict:
+    return {path.stem: np.load(path, mmap_mode="r") for path in Path(directory).glob("*.npy")}
+
+
+def _init_worker(panel_dir, market, starting_cash):
+    global _panel, _market, _starting_cash
+    _panel = load_panel(panel_dir)
+    _market = market
+    _starting_cash = starting_cash
+
+
+def _run_shard(shard):
+    results = []
+    for params in shard:
+        _, summary = run_backtest(_panel, _market, starting_cash=_starting_cash, **params)
+        results.append({**params, **summary})
+    return results
+
+
+def write_ranked(results, path, rank_by):
+    ranked = sorted(results, key=lambda row: row[rank_by], reverse=rank_by != "max_drawdown")
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(ranked[0]))
+        writer.writeheader()
+        writer.writerows(ranked)
+
+
+def run_sweep(panel: dict, market: str, grid: dict, out_path, workers=None, starting_cash=100_000.0, rank_by="total_pnl"):
+    """
+    Run a backtest for every combination in the grid on a process pool.
+
+    Rows are appended to `out_path` as each shard finishes and a ranked copy
+    is rewritten next to it, so partial results are usable mid-sweep.
+    """
+    workers = workers or os.cpu_count()
+    combos = combinations(grid)
+    # A few shards per worker keeps the pool busy without paying per-task overhead
+    shard_size = max(1, math.ceil(len(combos) / (workers * 4)))
+    shards = [combos[i : i + shard_size] for i in range(0, len(combos), shard_size)]
+
+    out_path = Path(out_path)
+    ranked_path = out_path.with_name(f"{out_path.stem}_ranked{out_path.suffix}")
+    results = []
+
+    with tempfile.TemporaryDirectory(prefix="sweep-panel-") as panel_dir:
+        save_panel(panel, panel_dir)
+        with (
+            ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(panel_dir, market, starting_cash)) as pool,
+            open(out_path, "w", newline="") as f,
+        ):
+            writer = None
+            futures = [pool.submit(_run_shard, shard) for shard in shards]
+            for future in as_completed(futures):
+                rows = future.result()
+                if writer is None:
+                    writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+                    writer.writeheader()
+                writer.writerows(rows)
+                f.flush()
+                results.extend(rows)
+                write_ranked(results, ranked_path, rank_by)
+                print(f"{len(results)}/{len(combos)} combinations done")
+
+    return sorted(results, key=lambda row: row[rank_by], reverse=rank_by != "max_drawdown")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep strategy parameters over local minute bars")
+    parser.add_argument("market_type", choices=["crypto", "stock"], help="Strategy variant to simulate")
+    parser.add_argument("bars", help="Parquet/CSV file or directory of minute bars")
+    parser.add_argument(
+        "--grid",
+        action="append",
+        default=[],
+        help=(
+            "Parameter values as name=v1,v2,... (repeatable), e.g. --grid stop_atr=1.5,2,3, "
+            "or --grid bracket_sizing=percent --grid stop_factor=0.95,0.98"
+        ),
+    )
+    parser.add_argument("--out", default="sweep_results.csv", help="CSV file results are streamed to")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: all cores)")
+    parser.add_argument("--cash", type=float, default=100_000.0, help="Starting account balance")
+    parser.add_argument("--rank-by", default="total_pnl", help="Summary column to rank by")
+    args = parser.parse_args()
+
+    grid = parse_grid(args.grid) or {"sma_window": [DEFAULT_PARAMS[args.market_type]["sma_window"]]}
+    panel = build_panel(load_bars(args.bars))
+
+    start = time.perf_counter()
+    results = run_sweep(panel, args.market_type, grid, args.out, args.workers, args.cash, args.rank_by)
+    print(f"Swept {len(results)} combinations in {time.perf_counter() - start:.2f}s")
+    for row in results[:10]:
+        print(row)
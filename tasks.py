@@ -0,0 +1,24 @@
+import asyncio
+
+# Strong references so running tasks aren't garbage collected mid-flight
+_background_tasks = set()
+
+
+def spawn(coro):
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+def concurrent_handler(handler):
+    """
+    Wrap a bar handler so the stream can dispatch the next bar while this
+    one is waiting on an order. The stream awaits its callbacks one at a
+    time, so without this every symbol queues behind the slowest order.
+    """
+
+    async def dispatch(data):
+        spawn(handler(data))
+
+    return dispatch
@@ -0,0 +1,153 @@
+import math
+import numpy as np
+from parameters import TICK_WINDOW_SECONDS
+
+# Columns of a second bar
+OPEN, HIGH, LOW, CLOSE, VOLUME = range(5)
+# Columns of the quote state
+BID, ASK, SPREAD, SPREAD_MEAN = range(4)
+
+
+class TickBook:
+    """
+    Second bars, running VWAP and spread statistics for every symbol, built
+    from streamed trades and quotes.
+
+    Each symbol owns a row of preallocated arrays: a ring of its last
+    `seconds` second bars, the running price*volume and volume behind its
+    VWAP, and its latest bid, ask, spread and an exponential mean of the
+    spread, both in basis points of the mid. Rows of dropped symbols are
+    reused, so memory depends on the universe and the window, not on the
+    tick rate.
+    """
+
+    def __init__(self, seconds=TICK_WINDOW_SECONDS, capacity=256, spread_alpha=0.05):
+        self.seconds = seconds
+        self.spread_alpha = spread_alpha
+        self.rows = {}
+        self._free = []
+        self.bars = np.zeros((0, seconds, 5))
+        self.times = np.zeros((0, seconds), dtype=np.int64)
+        # Epoch second of the bar each symbol is building
+        self.current = np.zeros(0, dtype=np.int64)
+        self.pv = np.zeros(0)
+        self.volume = np.zeros(0)
+        self.quotes = np.zeros((0, 4))
+        self._grow(capacity)
+
+    def __contains__(self, symbol):
+        return symbol in self.rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _grow(self, capacity):
+        """Reallocate every array with room for `capacity` symbols, keeping the rows in use"""
+        extra = capacity - len(self.current)
+        self._free.extend(range(capacity - 1, len(self.current) - 1, -1))
+        self.bars = np.concatenate([self.bars, np.zeros((extra, self.seconds, 5))])
+        self.times = np.concatenate([self.times, np.zeros((extra, self.seconds), dtype=np.int64)])
+        self.current = np.concatenate([self.current, np.zeros(extra, dtype=np.int64)])
+        self.pv = np.concatenate([self.pv, np.zeros(extra)])
+        self.volume = np.concatenate([self.volume, np.zeros(extra)])
+        self.quotes = np.concatenate([self.quotes, np.full((extra, 4), np.nan)])
+
+    def _row(self, symbol) -> int:
+        row = self.rows.get(symbol)
+        if row is None:
+            if not self._free:
+                self._grow(2 * len(self.current))
+            row = self.rows[symbol] = self._free.pop()
+        return row
+
+    def drop(self, symbol):
+        row = self.rows.pop(symbol, None)
+        if row is None:
+            return
+        self.bars[row] = 0.0
+        self.times[row] = 0
+        self.current[row] = 0
+        self.pv[row] = self.volume[row] = 0.0
+        self.quotes[row] = np.nan
+        self._free.append(row)
+
+    def on_trade(self, symbol, timestamp: float, price: float, size: float):
+        """
+        Add a trade; returns (epoch second, (open, high, low, close, volume))
+        of the bar it completed, or None. The bar is copied out before its
+        slot can be reused. Trades for a second already closed only count
+        towards the VWAP.
+        """
+        row = self._row(symbol)
+        self.pv[row] += price * size
+        self.volume[row] += size
+
+        second = int(timestamp)
+        current = int(self.current[row])
+        if second == current:
+            bar = self.bars[row, second % self.seconds]
+            if price > bar[HIGH]:
+                bar[HIGH] = price
+            elif price < bar[LOW]:
+                bar[LOW] = price
+            bar[CLOSE] = price
+            bar[VOLUME] += size
+            return None
+        if second < current:
+            return None
+        completed = (current, tuple(self.bars[row, current % self.seconds].tolist())) if current else None
+        slot = second % self.seconds
+        self.bars[row, slot] = (price, price, price, price, size)
+        self.times[row, slot] = second
+        self.current[row] = second
+        return completed
+
+    def on_quote(self, symbol, bid: float, ask: float):
+        if not (bid > 0 and ask >= bid):
+            # One-sided or crossed quotes say nothing about the spread
+            return
+        quote = self.quotes[self._row(symbol)]
+        spread = (ask - bid) / (ask + bid) * 20_000
+        mean = quote[SPREAD_MEAN]
+        quote[BID] = bid
+        quote[ASK] = ask
+        quote[SPREAD] = spread
+        quote[SPREAD_MEAN] = spread if math.isnan(mean) else mean + self.spread_alpha * (spread - mean)
+
+    def second_bar(self, symbol, second: int):
+        """(open, high, low, close, volume) of a second still in the window, or None"""
+        row = self.rows.get(symbol)
+        slot = second % self.seconds
+        if row is None or self.times[row, slot] != second:
+            return None
+        return tuple(self.bars[row, slot].tolist())
+
+    def window(self, symbol):
+        """Epoch seconds and bars of the window in time order; seconds without trades are left out"""
+        row = self.rows.get(symbol)
+        if row is None:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, 5))
+        times = self.times[row]
+        order = np.argsort(times)
+        order = order[times[order] > self.current[row] - self.seconds]
+        return times[order], self.bars[row, order]
+
+    def vwap(self, symbol) -> float:
+        row = self.rows.get(symbol)
+        if row is None or not self.volume[row]:
+            return math.nan
+        return float(self.pv[row] / self.volume[row])
+
+    def spread_bps(self, symbol) -> float:
+        """Latest quoted spread in basis points of the mid; inf before the first quote"""
+        row = self.rows.get(symbol)
+        if row is None or math.isnan(self.quotes[row, SPREAD]):
+            return math.inf
+        return float(self.quotes[row, SPREAD])
+
+    def spread_stats(self, symbol) -> dict:
+        row = self.rows.get(symbol)
+        if row is None:
+            return {}
+        bid, ask, spread, mean = self.quotes[row].tolist()
+        return {"bid": bid, "ask": ask, "spread_bps": spread, "spread_mean_bps": mean}
@@ -0,0 +1,102 @@
+import logging
+import threading
+import time
+from log import fields
+from parameters import UNIVERSE_REFRESH_SECONDS
+from positions import position_book
+
+logger = logging.getLogger("universe")
+
+
+class UniverseManager:
+    """
+    Keeps the stream subscribed to the current screener movers.
+
+    Each refresh diffs the new movers against the current subscriptions,
+    warms history only for symbols that are new and (un)subscribes only the
+    symbols that changed. Churn is limited by a cap on changes per refresh
+    and a minimum time a symbol stays subscribed; symbols we hold a
+    position in are never dropped.
+    """
+
+    def __init__(
+        self,
+        engine,
+        handler,
+        refresh_seconds=UNIVERSE_REFRESH_SECONDS,
+        max_changes=10,
+        min_hold_seconds=900,
+    ):
+        self.engine = engine
+        self.handler = handler
+        self.refresh_seconds = refresh_seconds
+        self.max_changes = max_changes
+        self.min_hold_seconds = min_hold_seconds
+        self.subscribed_at = {}
+        self._stop = threading.Event()
+
+    @property
+    def symbols(self):
+        return list(self.subscribed_at)
+
+    def update(self, movers, limit=True):
+        """Apply a new movers list; returns the (added, removed) symbols"""
+        now = time.monotonic()
+        target = list(dict.fromkeys(mover["symbol"] for mover in movers))
+        added = [s for s in target if s not in self.subscribed_at]
+        removed = [
+            s
+            for s in self.subscribed_at
+            if s not in target
+            and now - self.subscribed_at[s] >= self.min_hold_seconds
+            and not position_book.position(s)[0]
+        ]
+        if limit:
+            added, removed = added[: self.max_changes], removed[: self.max_changes]
+
+        engine = self.engine
+        stream = engine.market.stream
+        if added:
+            # One batched history request for all new symbols, set up before their bars can arrive
+            engine.runner.call(engine.adopt, *engine.history(added))
+            stream.subscribe_bars(self.handler, *added)
+            if engine.ticks is not None:
+                stream.subscribe_trades(engine.on_trade, *added)
+                stream.subscribe_quotes(engine.on_quote, *added)
+            for symbol in added:
+                self.subscribed_at[symbol] = now
+        if removed:
+            stream.unsubscribe_bars(*removed)
+            if engine.ticks is not None:
+                stream.unsubscribe_trades(*removed)
+                stream.unsubscribe_quotes(*removed)
+            for symbol in removed:
+                del self.subscribed_at[symbol]
+            engine.runner.call(self._drop, removed)
+        return added, removed
+
+    def _drop(self, symbols):
+        for symbol in symbols:
+            self.engine.drop(symbol)
+
+    def refresh(self):
+        gainers, losers = self.engine.market.get_movers()
+        added, removed = self.update(gainers + losers)
+        if added or removed:
+            logger.info(
+                "universe updated", extra=fields(added=added, removed=removed, symbols=len(self.subscribed_at))
+            )
+
+    def _run(self):
+        while not self._stop.wait(self.refresh_seconds):
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("error refreshing universe")
+
+    def start(self):
+        """Refresh in a background thread; subscription calls must not run on the stream's loop"""
+        threading.Thread(target=self._run, name="universe", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()